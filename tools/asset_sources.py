@@ -0,0 +1,105 @@
+## Sources of game assets for extract_labels: an unpacked assets directory
+## or a packed SBAsset6 archive like packed.pak.
+## Files in a source are named by their path relative to the assets root,
+## like "dialog/converse.config".
+
+from os import walk
+from os.path import join, relpath, isfile
+from codecs import open as open_n_decode
+from hashlib import sha1
+from mmap import mmap, ACCESS_READ
+from sys import platform
+from utils import file_stamp, content_hash
+from sbasset import read_index
+if platform == "win32":
+  from os.path import normpath as normpath_old
+  def normpath(path):
+    return normpath_old(path).replace('\\', '/')
+else:
+  from os.path import normpath
+
+
+def is_interesting(filename, endings, ignore_files):
+  thefile = filename.split("/")[-1]
+  return thefile.endswith(endings) and thefile not in ignore_files
+
+class DirectorySource():
+
+  def __init__(self, root):
+    self.root = root
+
+  def list(self, endings, ignore_files):
+    ## Returns names of files ending with one of endings except ignored ones
+    result = list()
+    for subdir, dirs, files in walk(self.root):
+      for thefile in files:
+        if is_interesting(thefile, endings, ignore_files):
+          result.append(normpath(relpath(join(subdir, thefile), self.root)))
+    return result
+
+  def read(self, name):
+    with open_n_decode(join(self.root, name), "r", "utf-8") as f:
+      return f.read()
+
+  def stamp(self, name, with_hash = False):
+    return file_stamp(join(self.root, name), with_hash)
+
+  def keep_stamp(self, name, oldstamp, check_hashes = False):
+    ## Returns the stamp to keep if the file was not changed since oldstamp
+    ## was made or None if it was changed
+    filename = join(self.root, name)
+    stamp = file_stamp(filename)
+    if oldstamp[:2] == stamp[:2]:
+      return oldstamp
+    if check_hashes and oldstamp[2] == content_hash(filename):
+      return stamp[:2] + oldstamp[2:]
+    return None
+
+class PakSource():
+  ## The archive is memory mapped, files are decoded right from the mapping.
+  ## Worker processes map the archive themselves when they need it
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.data = None
+    self.index = dict()
+    self.open()
+    metadata, index = read_index(self.data)
+    for path, location in index.items():
+      self.index[path.lstrip("/")] = location
+
+  def open(self):
+    with open(self.filename, "rb") as f:
+      self.data = mmap(f.fileno(), 0, access = ACCESS_READ)
+
+  def __getstate__(self):
+    return {"filename": self.filename, "index": self.index, "data": None}
+
+  def view(self, name):
+    if self.data is None:
+      self.open()
+    offset, size = self.index[name]
+    return memoryview(self.data)[offset:offset+size]
+
+  def list(self, endings, ignore_files):
+    return [name for name in self.index.keys()
+            if is_interesting(name, endings, ignore_files)]
+
+  def read(self, name):
+    return str(self.view(name), "utf-8")
+
+  def stamp(self, name, with_hash = False):
+    ## The files in archive have no mtime, so they are always hashed
+    return [self.index[name][1], None, sha1(self.view(name)).hexdigest()]
+
+  def keep_stamp(self, name, oldstamp, check_hashes = False):
+    stamp = self.stamp(name)
+    if oldstamp[2] == stamp[2]:
+      return stamp
+    return None
+
+def open_source(path):
+  ## Returns the source for an assets directory or an archive file
+  if isfile(path):
+    return PakSource(path)
+  return DirectorySource(path)
@@ -0,0 +1,221 @@
+#!/bin/python3
+# A script for measuring the speed of framework tools on game assets
+
+import argparse
+from os import walk, makedirs
+from os.path import join, getsize
+from json import dump, load
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from bisect import insort_left
+from time import perf_counter
+from pickle import dumps, loads
+import tracemalloc
+from multiprocessing import cpu_count
+from codecs import open as open_n_decode
+from json_tools import prepare
+from parser_settings import files_of_interest, ignore_files
+
+def list_assets(assets_dir):
+  result = list()
+  endings = tuple(files_of_interest.keys())
+  for subdir, dirs, files in walk(assets_dir):
+    for thefile in files:
+      if thefile.endswith(endings) and thefile not in ignore_files:
+        result.append(join(subdir, thefile))
+  return result
+
+def report(name, size, seconds):
+  print(name + ": " + str(round(size / 1048576, 2)) + " MB in " +
+    str(round(seconds, 2)) + " s, " +
+    str(round(size / 1048576 / max(seconds, 1e-9), 2)) + " MB/s")
+
+def bench_prepare(arguments):
+  ## Measures the comment stripping speed, file reading is not counted
+  sources = list()
+  size = 0
+  for filename in list_assets(arguments.assets):
+    with open_n_decode(filename, "r", "utf-8") as f:
+      sources.append(f.read())
+    size += getsize(filename)
+  start = perf_counter()
+  for source in sources:
+    prepare(source)
+  report("prepare", size, perf_counter() - start)
+
+def bench_ipc(arguments):
+  ## Compares the amount of data prepare_to_write sends to worker processes
+  ## when previous database is shipped with every label and when it is
+  ## shipped once per worker by the pool initializer
+  from extract_labels import construct_db, prepare_to_write, prefix, \
+    texts_prefix, load_old_substitutions, index_old_translations
+  database = construct_db(arguments.assets)
+  oldsubs = load_old_substitutions()
+  oldindex = index_old_translations(join(prefix, texts_prefix))
+  labels = [(val, database.files(label), section)
+            for val, label, section in database.labels()]
+  workers = cpu_count()
+  oldsize = len(dumps(oldsubs))
+  indexsize = len(dumps(oldindex))
+  labelsize = sum(len(dumps(label)) for label in labels)
+  # Labels were sent by chunks of 40, substitutions are pickled once per chunk
+  chunks = sum((len(labels) + 39) // 40 for labels in database.sections.values())
+  sections = len(database.sections)
+  before = labelsize + chunks * oldsize + sections * workers * indexsize
+  after = labelsize + workers * len(dumps((oldsubs, oldindex)))
+  print("Labels: " + str(len(labels)) + ", sections: " + str(sections) +
+    ", workers: " + str(workers))
+  print("IPC with substitutions in every label and a pool per section: " +
+    str(round(before / 1048576, 2)) + " MB")
+  print("IPC with shared state in worker initializer: " +
+    str(round(after / 1048576, 2)) + " MB")
+  start = perf_counter()
+  prepare_to_write(database)
+  print("prepare_to_write: " + str(round(perf_counter() - start, 2)) + " s")
+
+def bench_sharedpath(arguments):
+  ## Computes shared paths for all the labels like prepare_to_write does
+  ## and shows how often the caches of shared_path module are hit
+  from extract_labels import construct_db
+  from shared_path import getSharedPath, cacheStats
+  database = construct_db(arguments.assets)
+  labels = [database.files(label) for val, label, section in database.labels()]
+  start = perf_counter()
+  for files in labels:
+    getSharedPath(files.keys())
+  print("getSharedPath for " + str(len(labels)) + " labels: " +
+    str(round(perf_counter() - start, 2)) + " s")
+  for name, info in cacheStats().items():
+    print(name + ": " + str(info.hits) + " hits, " + str(info.misses) +
+      " misses, " + str(info.currsize) + " cached")
+
+def make_shared_assets(root, files, labels, fields):
+  ## Makes a synthetic assets tree of dialog files, every one of which uses
+  ## the same few labels in many fields
+  rand = Random(0)
+  texts = ["Label number " + str(i) for i in range(labels)]
+  makedirs(join(root, "dialog"))
+  for i in range(files):
+    content = {"dialog" + str(j): [rand.choice(texts) for k in range(10)]
+               for j in range(fields // 10)}
+    with open_n_decode(join(root, "dialog", str(i) + ".config"), "w",
+                       "utf-8") as f:
+      dump(content, f)
+
+def bench_construct(arguments):
+  ## Builds the database from a synthetic tree with heavily shared labels
+  ## and compares merging of the parsed files by sorted lists, like it was
+  ## done in the parent process before, with merging of the chunks
+  ## aggregated by workers
+  from extract_labels import construct_db, parseFile, aggregate
+  from label_db import LabelDB
+  root = mkdtemp()
+  try:
+    make_shared_assets(root, arguments.files, 5, 2000)
+    start = perf_counter()
+    database = construct_db(root)
+    print("construct_db: " + str(round(perf_counter() - start, 2)) + " s")
+    parsed = list()
+    for filename in list_assets(root):
+      parsed.append((filename, parseFile(filename)))
+  finally:
+    rmtree(root)
+  start = perf_counter()
+  db = dict()
+  for filename, labels in parsed:
+    for sec, val, fname, path in labels:
+      files = db.setdefault(sec, dict()).setdefault(val, dict())
+      if filename not in files:
+        files[filename] = list()
+      if path not in files[filename]:
+        insort_left(files[filename], path)
+  print("Merge by sorted lists: " + str(round(perf_counter() - start, 2)) +
+    " s")
+  start = perf_counter()
+  chunks = [(filename, aggregate(labels)) for filename, labels in parsed]
+  aggregated = perf_counter()
+  db = LabelDB()
+  for filename, chunk in chunks:
+    db.add_chunk(chunk, filename)
+  print("Aggregation in workers: " + str(round(aggregated - start, 2)) +
+    " s, merge of aggregated chunks: " +
+    str(round(perf_counter() - aggregated, 2)) + " s")
+  print("Labels: " + str(database.count()) +
+    ", fields: " + str(sum(len(labels) for filename, labels in parsed)))
+
+def translation_chunks(translations_dir):
+  ## Makes chunks like workers of construct_db send them from the labels of
+  ## translation database, pickled as they are passed between processes
+  chunks = dict()
+  for subdir, dirs, files in walk(join(translations_dir, "texts")):
+    for thefile in files:
+      with open_n_decode(join(subdir, thefile), "r", "utf-8") as f:
+        for label in load(f):
+          for asset, paths in label["Files"].items():
+            if asset not in chunks:
+              chunks[asset] = list()
+            chunks[asset].append([label.get("Comment", ""),
+                                  label["Texts"]["Eng"], sorted(set(paths))])
+  return [(asset, dumps(chunk)) for asset, chunk in sorted(chunks.items())]
+
+def nested_db(chunks):
+  ## The database of nested dicts, the parsed chunks were kept as well
+  db = {"": dict()}
+  kept = dict()
+  for filename, data in chunks:
+    chunk = loads(data)
+    for sec, val, paths in chunk:
+      db.setdefault(sec, dict()).setdefault(val, dict())[filename] = list(paths)
+    kept[filename] = chunk
+  return db, kept
+
+def compact_db(chunks):
+  from label_db import LabelDB
+  db = LabelDB()
+  for filename, data in chunks:
+    db.add_chunk(loads(data), filename)
+  return db
+
+def bench_memory(arguments):
+  ## Measures memory taken by the database of labels made from the
+  ## translation database, as nested dicts and as LabelDB
+  chunks = translation_chunks(arguments.translations)
+  print("Asset files: " + str(len(chunks)))
+  for name, build in [("nested dicts", nested_db), ("LabelDB", compact_db)]:
+    tracemalloc.start()
+    start = perf_counter()
+    db = build(chunks)
+    seconds = perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del db
+    print(name + ": " + str(round(current / 1048576, 1)) + " MB kept, " +
+      str(round(peak / 1048576, 1)) + " MB peak, " + str(round(seconds, 2)) +
+      " s")
+
+benchmarks = {
+  "memory": bench_memory,
+  "construct": bench_construct,
+  "prepare": bench_prepare,
+  "ipc": bench_ipc,
+  "sharedpath": bench_sharedpath,
+}
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Measure the speed of framework tools.")
+  parser.add_argument('--assets', default="./assets",
+                      help='unpacked game assets directory')
+  parser.add_argument('--translations', default="./translations",
+                      help='translations directory')
+  parser.add_argument('--files', type=int, default=500,
+                      help='number of files in synthetic assets')
+  parser.add_argument('benchmark', nargs='+', choices=benchmarks.keys(),
+                      help='benchmarks to run')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  for name in arguments.benchmark:
+    benchmarks[name](arguments)
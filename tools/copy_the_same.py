@@ -1,53 +1,203 @@
 #!/bin/python3
-from json import load, dump
-from copy import deepcopy
+# Copies translations of the same english texts from other translation
+# files to the untranslated entries of destination files.
+# Sources and destinations may be files, directories or glob patterns.
+# When sources translate the same text differently, --conflicts selects
+# what to do:
+#   first - take the translation met first (default)
+#   last  - take the translation met last
+#   skip  - leave such texts untranslated
+#   error - report conflicts and change nothing
+# The --from-file sources go first in their order, then --from-db files
+# in the sorted order. Files found by a directory or a pattern are sorted.
+
+from json import load, dumps
+from os import walk
+from os.path import join, isdir
+from glob import glob
+from time import perf_counter
+from codecs import open as open_n_decode
+from multiprocessing import Pool
+from text_index import TextIndex, ignored_files
+from utils import write_if_changed
 import argparse
+from sys import platform
+if platform == "win32":
+  from os.path import normpath as normpath_old
+  def normpath(path):
+    return normpath_old(path).replace('\\', '/')
+else:
+  from os.path import normpath
+
+policies = ["first", "last", "skip", "error"]
+
 
 def parse_arguments():
   parser = argparse.ArgumentParser(
                    description="Copy translations from other db.")
-  parser.add_argument('--from-file', help='source json files',
-                      metavar='FILE', action="append",
-                      type=argparse.FileType('r'))
-  parser.add_argument('destination', nargs='+', help='target json files',
-                      type=argparse.FileType('r+'))
+  parser.add_argument('--from-file', help='source json files, directories '
+                      'or glob patterns', metavar='PATH', action="append",
+                      default=[])
+  parser.add_argument('--from-db', metavar='DIR',
+                      help='take translations from all the files of '
+                           'translation database dir, like translations/texts')
+  parser.add_argument('--index', metavar='FILE',
+                      help='file to keep the index of database from --from-db '
+                           'between runs')
+  parser.add_argument('--conflicts', choices=policies, default="first",
+                      help='what to do with texts translated differently '
+                           'in sources')
+  parser.add_argument('destination', nargs='+', help='target json files, '
+                      'directories or glob patterns')
   return parser.parse_args()
 
-def create_the_base(files):
-  result = dict()
-  for f in files:
-    jsonfile = load(f)
-    for entry in jsonfile:
-      translations = entry["Texts"]
-      if "Rus" in translations and len(translations["Rus"]) > 0:
-        eng = translations["Eng"]
-        if eng in result:
-          print("Translations conflict while reading inputs!")
-          print("Original: " + eng)
-          print("First: " + translations["Rus"])
-          print("Second: " + result[eng])
-          print("Autoselecting second for a while... FIXME")
-        else:
-          result[eng] = translations["Rus"]
+def expand_paths(patterns):
+  ## Returns json files of the given files, directories and glob patterns
+  ## in the order of patterns, every file once
+  result = list()
+  for pattern in patterns:
+    if isdir(pattern):
+      found = list()
+      for subdir, dirs, files in walk(pattern):
+        for thefile in files:
+          if thefile.endswith(".json") and thefile not in ignored_files:
+            found.append(join(subdir, thefile))
+    else:
+      found = glob(pattern)
+      if len(found) == 0:
+        print("No files match: " + pattern)
+    for filename in sorted(normpath(f) for f in found):
+      if filename not in result:
+        result.append(filename)
   return result
 
-def merge_the_base(base, files):
-  for f in files:
-    newjson = list()
-    jsonfile = load(f)
-    for entry in jsonfile:
-      newentry = deepcopy(entry)
-      eng = entry["Texts"]["Eng"]
-      if eng in base and ("Rus" not in entry["Texts"] or
-                          len(entry["Texts"]["Rus"]) == 0):
-        newentry["Texts"]["Rus"] = base[eng]
-      newjson += [newentry]
-    f.seek(0)
-    f.truncate()
-    dump(newjson, f, ensure_ascii=False, indent=2, sort_keys=True)
+def read_file(filename):
+  ## Returns the labels of translation file or None if it is not one
+  try:
+    with open_n_decode(filename, "r", "utf-8") as f:
+      jsondata = load(f)
+    if type(jsondata) is list and all("Texts" in e for e in jsondata):
+      return jsondata
+  except:
+    pass
+  print("Cannot parse file: " + filename)
+  return None
+
+def read_translations(filename):
+  ## Returns a list of (english text, translation) of the translation file
+  jsondata = read_file(filename)
+  if jsondata is None:
+    return []
+  result = list()
+  for entry in jsondata:
+    translations = entry["Texts"]
+    if len(translations.get("Rus", "")) > 0:
+      result.append((translations["Eng"], translations["Rus"]))
+  return result
+
+def add_translation(texts, filename, eng, rus):
+  ## Remembers the translation unless the same one is already known
+  ## texts - { "english text": [(file, translation), ...] }
+  if eng not in texts:
+    texts[eng] = [(filename, rus)]
+  elif all(rus != known for f, known in texts[eng]):
+    texts[eng].append((filename, rus))
+
+def create_the_base(files, texts):
+  ## Reads the translations of files in parallel to texts,
+  ## see add_translation
+  with Pool() as p:
+    for filename, translations in zip(files,
+                                      p.imap(read_translations, files, 20)):
+      for eng, rus in translations:
+        add_translation(texts, filename, eng, rus)
+
+def base_from_index(index, texts):
+  ## Like create_the_base, but takes translations from the index of
+  ## translation database, see TextIndex
+  for eng, places in index.translations().items():
+    for filename, rus in places:
+      add_translation(texts, filename, eng, rus)
+
+def resolve(texts, policy):
+  ## Returns the base { "english text": translation } and a sorted list
+  ## of conflicts as (english text, [(file, translation), ...])
+  base = dict()
+  conflicts = list()
+  for eng, places in texts.items():
+    if len(places) > 1:
+      conflicts.append((eng, places))
+      if policy == "skip":
+        continue
+    base[eng] = places[-1 if policy == "last" else 0][1]
+  conflicts.sort()
+  return base, conflicts
+
+def report_conflicts(conflicts, base):
+  for eng, places in conflicts:
+    print("Translations conflict while reading inputs!")
+    print("Original: " + eng)
+    for filename, rus in places:
+      print("  " + filename + ": " + rus)
+    if eng in base:
+      print("Selected: " + base[eng])
+    else:
+      print("Left untranslated")
+
+def init_base(thebase):
+  ## Pool initializer, passes the base to worker processes once
+  global base
+  base = thebase
+
+def merge_file(filename):
+  ## Copies translations from the base to untranslated entries of the file
+  ## The file is written only if something is copied
+  ## Returns a tuple of filename and number of translations copied
+  jsondata = read_file(filename)
+  if jsondata is None:
+    return filename, 0
+  copied = 0
+  for entry in jsondata:
+    eng = entry["Texts"]["Eng"]
+    if eng in base and len(entry["Texts"].get("Rus", "")) == 0:
+      entry["Texts"]["Rus"] = base[eng]
+      copied += 1
+  if copied > 0:
+    write_if_changed(filename, dumps(jsondata, ensure_ascii=False, indent=2,
+                                     sort_keys=True))
+  return filename, copied
+
+def merge_the_base(thebase, files):
+  ## Applies the base to the files in parallel
+  ## Returns the number of files changed and translations copied
+  changed = 0
+  total = 0
+  with Pool(initializer=init_base, initargs=(thebase,)) as p:
+    for filename, copied in p.imap_unordered(merge_file, files, 10):
+      if copied > 0:
+        changed += 1
+        total += copied
+  return changed, total
 
 if __name__ == "__main__":
   arguments = parse_arguments()
-  base = create_the_base(arguments.from_file)
-  merge_the_base(base, arguments.destination)
-
+  start = perf_counter()
+  texts = dict()
+  create_the_base(expand_paths(arguments.from_file), texts)
+  if arguments.from_db is not None:
+    index = TextIndex(arguments.from_db, arguments.index)
+    index.update()
+    index.save()
+    base_from_index(index, texts)
+  thebase, conflicts = resolve(texts, arguments.conflicts)
+  report_conflicts(conflicts, thebase)
+  print("Translations known: " + str(len(texts)) + ", conflicts: " +
+        str(len(conflicts)))
+  if arguments.conflicts == "error" and len(conflicts) > 0:
+    print("Nothing is changed because of conflicts")
+    exit(1)
+  destinations = expand_paths(arguments.destination)
+  changed, total = merge_the_base(thebase, destinations)
+  print("Files changed: " + str(changed) + " of " + str(len(destinations)) +
+        ", translations copied: " + str(total) + " in " +
+        str(round(perf_counter() - start, 2)) + " s")
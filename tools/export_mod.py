@@ -1,161 +1,413 @@
 #!/bin/python
 # A script for export framework data to unpacked mod file structure
 
-from os import walk, makedirs, sep
+from os import walk, sep, remove, replace
 from os.path import join, relpath, dirname, exists, normpath, basename
-from json import load, dump
-from shutil import copy
-from json_tools import field_by_path
-from re import compile as regex
+from json import load, dumps
 from codecs import open as copen
+from multiprocessing import Pool
+from utils import file_stamp, content_hash, write_if_changed
+from sbasset import PakWriter
+from file_sync import FileSync
+from layout_check import label_overflows
+from translation_db import TranslationDB
+from substitution_shards import shards_dir
+import argparse
 
 def uopen(path, mode):
   return copen(path, mode, "utf-8")
 translations_dir = "./translations"
 mod_dir = "./new_mod"
-
-checker = regex('([^\n\s\t\r]+|\r?[\n\s\t])')
-is_unprintable = regex('\^.+;')
-
-patchfiles = dict()
-
-emotes = dict()
-glitchFixed = list()
-labelsTotal = dict()
-labelsTranslated = dict()
+## Keeps the state of previous export, see export
+manifest_file = "./export_manifest.json"
 
 others_path = normpath(join(translations_dir, "others"))
+shards_path = normpath(join(translations_dir, shards_dir))
 others_dest = normpath(mod_dir)
+ignored_files = ["substitutions.json", "totallabels.json", "translatedlabels.json"]
 
 
-def sum_up_counter(counter):
-  result = 0
-  for l, n in counter.items():
-    if not type(n) is int:
-      result += sum_up_counter(n)
-    else:
-      result += n
+def counts_tree(counts, index):
+  ## Makes a tree of directories with the counts of labels in leaves
+  ## counts - a dict {file: (total, translated)}, see collect_counts
+  ## index - 0 for total labels count, 1 for translated
+  tree = dict()
+  for path, count in counts.items():
+    parts = path.split(sep)
+    node = tree
+    for part in parts[:-1]:
+      if part not in node:
+        node[part] = dict()
+      node = node[part]
+    node[parts[-1]] = count[index]
+  return tree
+
+def directory_counts(counts, depth):
+  ## Sums up the counts for directories at given depth
+  ## Returns a dict {directory: [total, translated]}
+  result = dict()
+  for path, (total, translated) in counts.items():
+    directory = sep.join(path.split(sep)[:-1][:depth])
+    if directory not in result:
+      result[directory] = [0, 0]
+    result[directory][0] += total
+    result[directory][1] += translated
   return result
 
-def set_count(counter, path, value):
-  ## Sets the count of the translated or total elements for specific path
-  thepath = normpath(relpath(path, translations_dir))
-  field_by_path(counter, thepath, value, sep)
-
-def add_count(counter, path, value):
-  thepath = normpath(relpath(path, translations_dir))
-  oldval = field_by_path(counter, thepath, sep=sep)
-  field_by_path(counter, thepath, oldval+1, sep)
-
-
-def check_translation_length(text):
-  ## 15 height, 36 width
-  words = checker.split(text)
-  maxwidth = 40
-  width = maxwidth
-  height = 17 - 1 # First string already taken anyway
-  for word in words:
-    wlen = len(word)
-    if wlen == 0 or is_unprintable.match(word):
-      continue
-    if word == '\n':
-      height -= 1
-      width = maxwidth
-      continue
-    width -= wlen
-    if width < 0 and not word == ' ':
-      width = maxwidth - wlen
-      height -= 1
-  return height >= 0
 
-specials = dict()
+def export_file(filename):
+  ## Parses the translation file and returns a tuple of
+  ## labels total, labels translated and a list of patch events,
+  ## or None if the file can not be parsed.
+  ## An event is a tuple (patchfile, jsonpath, translation) in the order
+  ## the replacements should appear in patches, jsonpath and translation
+  ## are None if the event only tells that patchfile should exist
+  jsondata = list()
+  try:
+    with uopen(filename, "r") as f:
+      jsondata = load(f)
+  except:
+    print("Cannot parse file: " + filename)
+    return None
+  return export_labels(filename, jsondata)
 
-for subdir, dirs, files in walk(translations_dir):
-  for thefile in files:
-    if thefile in ["substitutions.json", "totallabels.json", "translatedlabels.json"]:
-      continue
-    filename = normpath(join(subdir, thefile))
-    if filename.startswith(others_path):
-      filename = relpath(filename, others_path)
-      dest = join(others_dest, filename)
-      makedirs(dirname(dest), exist_ok = True)
-      copy(join(subdir, thefile), dest)
+def export_labels(filename, jsondata):
+  ## Returns the same as export_file for the labels of translation file
+  translated = 0
+  events = list()
+  for label in jsondata:
+    if "Rus" not in label["Texts"] or len(label["Texts"]["Rus"]) == 0:
       continue
-    filename = normpath(join(subdir, thefile))
-    jsondata = list()
-    try:
-      with uopen(filename, "r") as f:
-        jsondata = load(f)
-    except:
-      print("Cannot parse file: " + filename)
+    translated += 1
+    translation = label["Texts"]["Rus"]
+    for asset, path, profile, lines in label_overflows(label):
+      print("Warning! String too long in file: " + filename + " (" +
+            profile.name + ", " + asset + path + ")")
+    for originfile, jsonpaths in label["Files"].items():
+      patchfile = normpath(join(mod_dir, originfile + ".patch"))
+      events.append((patchfile, None, None))
+      for jsonpath in jsonpaths:
+        events.append((patchfile, jsonpath, translation))
+  return len(jsondata), translated, events
+
+def add_replacement(patchfiles, specials, patchfile, jsonpath, translation):
+  ## Adds replace command to the patch. Glitch emote and text are stored in
+  ## different labels, they are joined in one command when both are found
+  specialpaths = ["glitchEmote", "glitchEmotedText"]
+  jsonpathend = basename(jsonpath)
+  if jsonpathend in specialpaths:
+    if patchfile not in specials:
+      specials[patchfile] = dict()
+    specials[patchfile][jsonpath] = translation
+    specialpaths.remove(jsonpathend)
+    basepath = dirname(jsonpath)
+    restpath = join(basepath, specialpaths.pop())
+    if  restpath in specials[patchfile]:
+      emotepath = join(basepath, "glitchEmote")
+      textpath = join(basepath, "glitchEmotedText")
+      emote = specials[patchfile][emotepath]
+      text = specials[patchfile][textpath]
+      command = dict()
+      command["op"] = "replace"
+      command["value"] = emote + " " + text
+      command["path"] = basepath
+      patchfiles[patchfile].append(command)
+  else:
+    command = dict()
+    command["op"] = "replace"
+    command["value"] = translation
+    command["path"] = jsonpath
+    patchfiles[patchfile].append(command)
+
+def sort_commands(commands):
+  ## Leaves only the last command for each path and sorts them by path,
+  ## so the patch content does not depend on the order of translations
+  bypath = dict()
+  for command in commands:
+    bypath[command["path"]] = command
+  return [bypath[path] for path in sorted(bypath.keys())]
+
+def write_patch(pak, pfile, content):
+  ## Writes the patch to the archive if it is given or to mod_dir otherwise
+  if pak is not None:
+    pak.add(asset_path(pfile), content)
+    return True
+  return write_if_changed(pfile, content)
+
+def list_translations():
+  ## Returns a list of translation files and
+  ## a dict of other files {path in framework: path in mod}
+  texts = list()
+  others = dict()
+  for subdir, dirs, files in walk(translations_dir):
+    for thefile in files:
+      if thefile in ignored_files:
+        continue
+      filename = normpath(join(subdir, thefile))
+      if filename.startswith(shards_path + sep):
+        continue
+      if filename.startswith(others_path):
+        dest = normpath(join(others_dest, relpath(filename, others_path)))
+        others[filename] = dest
+        continue
+      texts.append(filename)
+  return texts, others
+
+def is_changed(filename, stamps):
+  ## Checks the file against its stamp from manifest, updates the stamp
+  ## if only mtime is changed, but the content is the same
+  if filename not in stamps:
+    return True
+  stamp = file_stamp(filename)
+  if stamps[filename][:2] == stamp[:2]:
+    return False
+  if stamps[filename][2] == content_hash(filename):
+    stamps[filename] = stamp[:2] + stamps[filename][2:]
+    return False
+  return True
+
+def load_manifest():
+  try:
+    with uopen(manifest_file, "r") as f:
+      return load(f)
+  except:
+    return {"files": dict(), "others": dict()}
+
+def save_manifest(manifest):
+  tmpfile = manifest_file + ".tmp"
+  with uopen(tmpfile, "w") as f:
+    f.write(dumps(manifest, ensure_ascii=False))
+  replace(tmpfile, manifest_file)
+
+def asset_path(dest):
+  ## Returns path of file from mod_dir inside game assets
+  return "/" + relpath(dest, others_dest).replace(sep, "/")
+
+def export(full = False, pak = None, hardlinks = False, store = None):
+  ## Exports the framework to mod_dir. The manifest keeps stamps of
+  ## translation files and the patches each of them feeds, so only
+  ## the patches fed by changed files are made again.
+  ## The manifest has a following structure:
+  ## {"files": { "translation file" : { "stamp": [size, mtime, hash],
+  ##    "patches": [patch files], "total": n, "translated": n } },
+  ##  "others": { "patch file in others": [size, mtime, hash] } }
+  ## full - ignore the manifest and make all the patches
+  ## pak - a PakWriter to put the mod into instead of mod_dir,
+  ##   always makes all the patches and does not touch the manifest
+  ## hardlinks - link other files into mod_dir instead of copying them
+  ## store - a TranslationDB to take the translations from instead of
+  ##   json files, always makes all the patches and does not touch
+  ##   the manifest
+  manifest = {"files": dict(), "others": dict()}
+  if not full and pak is None and store is None:
+    manifest = load_manifest()
+  entries = manifest["files"]
+  texts, others = list_translations()
+  if store is not None:
+    texts = [normpath(join(translations_dir, name)) for name in store.files()]
+  ## Patches from others are joined with generated ones
+  others_patches = dict()
+  sync = FileSync(hardlinks)
+  for source, dest in others.items():
+    if dest.endswith(".patch"):
+      others_patches[dest] = source
+    elif pak is not None and asset_path(dest) == "/_metadata":
+      with uopen(source, "r") as f:
+        pak.metadata = load(f)
+    elif pak is not None:
+      with open(source, "rb") as f:
+        pak.add(asset_path(dest), f.read())
+    else:
+      sync.sync(source, dest)
+  if pak is None:
+    print(sync.report())
+  affected = set()
+  stamps = dict((f, e["stamp"]) for f, e in entries.items())
+  if store is not None:
+    changed = texts
+  else:
+    changed = [f for f in texts if is_changed(f, stamps)]
+  for filename, stamp in stamps.items():
+    if filename in entries:
+      entries[filename]["stamp"] = stamp
+  textset = set(texts)
+  for filename in list(entries.keys()):
+    if filename not in textset:
+      affected.update(entries.pop(filename)["patches"])
+  for filename in changed:
+    if filename in entries:
+      affected.update(entries[filename]["patches"])
+  for dest, source in others_patches.items():
+    if pak is None and not exists(dest):
+      affected.add(dest)
+    if is_changed(source, manifest["others"]):
+      affected.add(dest)
+      manifest["others"][source] = file_stamp(source, True)
+  for source in list(manifest["others"].keys()):
+    if source not in others:
+      affected.add(normpath(join(others_dest, relpath(source, others_path))))
+      del manifest["others"][source]
+  for entry in entries.values():
+    for patchfile in entry["patches"]:
+      if pak is None and not exists(patchfile):
+        affected.add(patchfile)
+  print("Translation files changed: " + str(len(changed)))
+  results = dict()
+  with Pool() as p:
+    if store is not None:
+      exported = (export_labels(f, store.read_file(
+                    normpath(relpath(f, translations_dir)))) for f in changed)
+    else:
+      exported = p.imap(export_file, changed, 10)
+    for filename, result in zip(changed, exported):
+      results[filename] = result
+      stamp = None if store is not None else file_stamp(filename, True)
+      entry = {"stamp": stamp, "patches": list(),
+               "total": None, "translated": None}
+      if result is not None:
+        entry["total"], entry["translated"], events = result
+        entry["patches"] = sorted(set(e[0] for e in events))
+        affected.update(entry["patches"])
+      entries[filename] = entry
+    ## Unchanged files feeding the affected patches should be parsed too
+    contributors = [f for f in texts if f not in results and
+                    not affected.isdisjoint(entries[f]["patches"])]
+    for filename, result in zip(contributors,
+                                p.imap(export_file, contributors, 10)):
+      results[filename] = result
+  patchfiles = dict()
+  specials = dict()
+  for filename in texts:
+    if results.get(filename) is None:
       continue
-    set_count(labelsTotal,filename, len(jsondata))
-    set_count(labelsTranslated,filename, 0)
-    for label in jsondata:
-      if "Rus" not in label["Texts"] or len(label["Texts"]["Rus"]) == 0:
+    for patchfile, jsonpath, translation in results[filename][2]:
+      if patchfile not in affected:
         continue
+      if patchfile not in patchfiles:
+        patchfiles[patchfile] = list()
+      if jsonpath is not None:
+        add_replacement(patchfiles, specials, patchfile, jsonpath, translation)
+  written = 0
+  for pfile in sorted(affected):
+    if pfile in patchfiles:
+      thecontent = sort_commands(patchfiles[pfile])
+      if pfile in others_patches:
+        with uopen(others_patches[pfile], 'r') as f:
+          thecontent += load(f)
+      if write_patch(pak, pfile, dumps(thecontent, ensure_ascii=False, indent = 2)):
+        written += 1
+    elif pfile in others_patches:
+      with open(others_patches[pfile], "rb") as f:
+        if write_patch(pak, pfile, f.read()):
+          written += 1
+    elif pak is None and exists(pfile):
+      remove(pfile)
+  print("Patches written: " + str(written) + " of " + str(len(affected)))
+  if pak is None and store is None:
+    save_manifest(manifest)
+  return texts, entries
+
+def count_labels(filename):
+  ## Returns total and translated labels count of the translation file
+  ## or None if the file can not be parsed
+  try:
+    with uopen(filename, "r") as f:
+      jsondata = load(f)
+  except:
+    print("Cannot parse file: " + filename)
+    return None
+  translated = 0
+  for label in jsondata:
+    if "Rus" in label["Texts"] and len(label["Texts"]["Rus"]) > 0:
+      translated += 1
+  return len(jsondata), translated
+
+def collect_counts(texts, entries):
+  ## Returns a dict {file relative to translations_dir: (total, translated)}
+  ## entries - the files section of export manifest, the counts of files
+  ##   not changed since the export are taken from there
+  stamps = dict((f, e["stamp"]) for f, e in entries.items())
+  changed = [f for f in texts if is_changed(f, stamps)]
+  with Pool() as p:
+    for filename, count in zip(changed, p.imap(count_labels, changed, 10)):
+      entries[filename] = {"total": None, "translated": None}
+      if count is not None:
+        entries[filename]["total"], entries[filename]["translated"] = count
+  return entry_counts(texts, entries)
 
-      add_count(labelsTranslated, filename, 1)
-      translation = label["Texts"]["Rus"]
-      if filename.endswith("codex.json") and not check_translation_length(translation):
-        print("Warning! String too long in file: " + filename)
-      
-      for originfile, jsonpaths in label["Files"].items():
-        patchfile = normpath(join(mod_dir, originfile + ".patch"))
-        if patchfile not in patchfiles:
-          patchfiles[patchfile] = list()
-        for jsonpath in jsonpaths:
-          specialpaths = ["glitchEmote", "glitchEmotedText"]
-          jsonpathend = basename(jsonpath)
-          if jsonpathend in specialpaths:
-            if patchfile not in specials:
-              specials[patchfile] = dict()
-            specials[patchfile][jsonpath] = translation
-            specialpaths.remove(jsonpathend)
-            basepath = dirname(jsonpath)
-            restpath = join(basepath, specialpaths.pop())
-            if  restpath in specials[patchfile]:
-              emotepath = join(basepath, "glitchEmote")
-              textpath = join(basepath, "glitchEmotedText")
-              emote = specials[patchfile][emotepath]
-              text = specials[patchfile][textpath]
-              command = dict()
-              command["op"] = "replace"
-              command["value"] = emote + " " + text
-              command["path"] = basepath
-              patchfiles[patchfile].append(command)
-          else:
-            command = dict()
-            command["op"] = "replace"
-            command["value"] = translation
-            command["path"] = jsonpath
-            patchfiles[patchfile].append(command)
-              
-
-for pfile, content in patchfiles.items():
-  makedirs(dirname(pfile), exist_ok = True)
-  thecontent = content
-  if exists(pfile):
-    with uopen(pfile, 'r') as f:
-      thecontent += load(f)
-  with uopen(pfile, "w") as f:
-    dump(thecontent, f, ensure_ascii=False, indent = 2)
-
-labelsTranslatedN = 0
-labelsTotalN = 0
-
-
-
-labelsTotalN = sum_up_counter(labelsTotal)
-labelsTranslatedN = sum_up_counter(labelsTranslated)
-
-  
-with uopen(join(translations_dir, "translatedlabels.json"), "w") as f:
-  dump(labelsTranslated, f, indent = 2, sort_keys=True)
-with uopen(join(translations_dir, "totallabels.json"), "w") as f:
-  dump(labelsTotal, f, indent = 2, sort_keys=True)
-
-print("Statistics:")
-print("Translated labels: " + str(labelsTranslatedN))
-print("Summary labels: " + str(labelsTotalN))
-print("Completion: " + str(labelsTranslatedN*100/labelsTotalN) + "%")
+def entry_counts(texts, entries):
+  ## Returns the counts like collect_counts does, taking all of them
+  ## from the export manifest entries
+  counts = dict()
+  for filename in texts:
+    if entries[filename]["total"] is not None:
+      thepath = normpath(relpath(filename, translations_dir))
+      counts[thepath] = (entries[filename]["total"],
+                         entries[filename]["translated"])
+  return counts
+
+def write_statistics(counts):
+  labelsTotalN = sum(total for total, translated in counts.values())
+  labelsTranslatedN = sum(translated for total, translated in counts.values())
+
+  with uopen(join(translations_dir, "translatedlabels.json"), "w") as f:
+    f.write(dumps(counts_tree(counts, 1), indent = 2, sort_keys=True))
+  with uopen(join(translations_dir, "totallabels.json"), "w") as f:
+    f.write(dumps(counts_tree(counts, 0), indent = 2, sort_keys=True))
+
+  print("Statistics:")
+  print("Translated labels: " + str(labelsTranslatedN))
+  print("Summary labels: " + str(labelsTotalN))
+  print("Completion: " + str(labelsTranslatedN*100/labelsTotalN) + "%")
+
+def print_report(counts, depth):
+  ## Prints completion of every directory at given depth
+  for directory, (total, translated) in sorted(
+      directory_counts(counts, depth).items()):
+    completion = translated*100/total if total > 0 else 100
+    print(directory + ": " + str(translated) + "/" + str(total) + " (" +
+      str(round(completion, 1)) + "%)")
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Export framework data to unpacked mod.")
+  parser.add_argument('--full', action='store_true',
+                      help='make all the patches, not only changed ones')
+  parser.add_argument('--pak', metavar='FILE',
+                      help='pack the mod to SBAsset6 archive instead of '
+                           'writing it to ' + mod_dir)
+  parser.add_argument('--link', action='store_true',
+                      help='hardlink files from others to the mod instead '
+                           'of copying them')
+  parser.add_argument('--db', metavar='FILE',
+                      help='export from SQLite translation database instead '
+                           'of json files, see translation_db.py')
+  parser.add_argument('--report', action='store_true',
+                      help='only show completion of directories, '
+                           'do not export anything')
+  parser.add_argument('--depth', type=int, default=2,
+                      help='depth of directories in the report')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  if arguments.report:
+    texts, others = list_translations()
+    counts = collect_counts(texts, load_manifest()["files"])
+    print_report(counts, arguments.depth)
+  else:
+    store = None
+    if arguments.db is not None:
+      store = TranslationDB(arguments.db)
+    if arguments.pak is not None:
+      with PakWriter(arguments.pak) as pak:
+        texts, entries = export(True, pak, store = store)
+      print("Written " + str(pak.written) + " bytes of " +
+        str(len(pak.index)) + " files to " + arguments.pak)
+    else:
+      texts, entries = export(arguments.full, hardlinks = arguments.link,
+                              store = store)
+    if store is not None:
+      write_statistics(entry_counts(texts, entries))
+    else:
+      write_statistics(collect_counts(texts, entries))
@@ -2,7 +2,7 @@
 # A script for label extraction from unpacked game assets
 
 
-from os.path import join, dirname, exists, relpath, abspath, basename
+from os.path import join, dirname, relpath, basename
 from sys import platform
 if platform == "win32":
   from os.path import normpath as normpath_old
@@ -12,19 +12,33 @@ else:
   from os.path import normpath
 from codecs import open as open_n_decode
 from shared_path import getSharedPath
-from json_tools import prepare, field_by_path, list_field_paths
+from json_tools import prepare, walk_fields
 from re import compile as regex
-from multiprocessing import Pool
-from os import walk, makedirs, remove
-from json import load, dump, loads
-from parser_settings import files_of_interest, ignore_files
-from utils import get_answer
+from multiprocessing import Pool, cpu_count
+from collections import deque
+from time import time
+from os import walk, remove
+from json import dumps, loads
+from parser_settings import files_of_interest, ignore_files, paths_of_interest
+from utils import get_answer, write_if_changed
+from asset_sources import open_source
+from text_index import TextIndex
+from substitution_shards import load_substitutions, write_substitutions
+from translation_db import TranslationDB
+from label_db import LabelDB
+import label_db
 from bisect import insort_left
-from special_cases import specialSections
+from special_cases import sectionMatcher
+from extraction_cache import settings_fingerprint, empty_cache, load_cache, save_cache
+import argparse
 
 root_dir = "./assets"
+cache_file = "./extraction_cache.json"
+index_file = "./text_index.json"
 prefix = "./translations"
 texts_prefix = "texts"
+## The key of substitutions in the file buffer, they are written by
+## substitution_shards in the layout the database uses
 sub_file = normpath(join(prefix, "substitutions.json"))
 
 glitchEmoteExtractor = regex("^([In]{,3}\s?[A-Za-z-]+\.)\s+(.*)")
@@ -32,11 +46,7 @@ glitchIsHere = regex("^.*[gG]litch.*")
 
 
 def defaultHandler(val, filename, path):
-  sec = ""
-  for pattern in specialSections:
-    if pattern.match(filename, path):
-      sec = pattern.name
-      break
+  sec = sectionMatcher.for_file(filename).section(path)
   return [(sec, val, filename, path)]
   
 def glitchDescriptionSpecialHandler(val, filename, path):
@@ -73,65 +83,112 @@ specialSharedPaths = {
   "glitchEmote": "glitchEmotes",
 }
 
-def parseFile(filename):
+def parseFile(filename, content = None):
+  ## content - the text of file if it is already read
   chunk = list()
-  with open_n_decode(filename, "r", "utf-8") as f:
-    string = prepare(f)
-    jsondata = dict()
-    try:
-      jsondata = loads(string)
-    except:
-      print("Cannot parse " + filename)
-      return []
-    paths = list_field_paths(jsondata)
-    dialog =  dirname(filename).endswith("dialog")
-    for path in paths:
-      for k in files_of_interest.keys():
-        if filename.endswith(k) or k == "*":
-          for roi in files_of_interest[k]:
-            if roi.match(path) or dialog:
-              val = field_by_path(jsondata, path)
-              if not type(val) is str:
-                print("File: " + filename)
-                print("Type of " + path + " is not a string!")
-                continue
-              if val == "":
-                continue
-              for handler in textHandlers:
-                res = handler(val, filename, '/' + path)
-                if res:
-                  chunk += res
-                  break
-              break
+  if content is None:
+    with open_n_decode(filename, "r", "utf-8") as f:
+      content = f.read()
+  string = prepare(content)
+  jsondata = dict()
+  try:
+    jsondata = loads(string)
+  except:
+    print("Cannot parse " + filename)
+    return []
+  roi = paths_of_interest.for_file(filename)
+  if roi is None:
+    return []
+  dialog =  dirname(filename).endswith("dialog")
+  for path, val in walk_fields(jsondata):
+    if not (dialog or roi.match(path)):
+      continue
+    if not type(val) is str:
+      print("File: " + filename)
+      print("Type of " + path + " is not a string!")
+      continue
+    if val == "":
+      continue
+    for handler in textHandlers:
+      res = handler(val, filename, '/' + path)
+      if res:
+        chunk += res
+        break
   return chunk
 
-def construct_db(assets_dir):
-  ## Creating a database of text labels from game assets dir given
-  ## the database has a following structure:
+## The source of assets in worker processes, see init_assets
+assets = None
+
+def init_assets(source):
+  ## Pool initializer, passes the source of assets to worker processes
+  global assets
+  assets = source
+
+def aggregate(labels):
+  ## Groups the fields of labels found in one file
+  ## Returns a chunk: a list of [section, label, [sorted fields]]
+  fields = dict()
+  for sec, val, fname, path in labels:
+    key = (sec, val)
+    if key not in fields:
+      fields[key] = set()
+    fields[key].add(path)
+  return [[sec, val, sorted(paths)] for (sec, val), paths in fields.items()]
+
+def parse_asset(args):
+  ## Parses the file and returns it with its stamp for the cache
+  ## args - a tuple of file name in assets and a flag,
+  ##   is the content hash needed
+  filename, with_hash = args
+  stamp = assets.stamp(filename, with_hash)
+  chunk = aggregate(parseFile(filename, assets.read(filename)))
+  return filename, stamp, chunk
+
+def construct_db(assets_dir, cache_file = None, check_hashes = False):
+  ## Creating a database of text labels from game assets dir or
+  ## packed assets file given
+  ## Returns LabelDB, its to_json gives a following structure:
   ## {"section": { "label" :
   ##   { "files were it used" : [list of fields were it used in file] } } }
+  ## cache_file - a file to keep parsed labels between runs, only the files
+  ##   changed since the previous run are parsed if it is given
+  ## check_hashes - compare content of files with changed size or mtime
+  ##   to the cached one, useful after fresh unpacking of the assets
   print("Scanning assets at " + assets_dir)
-  db = dict()
-  db[""] = dict()
-  foi = list()
-  endings = tuple(files_of_interest.keys())
-  for subdir, dirs, files in walk(assets_dir):
-    for thefile in files:
-      if thefile.endswith(endings) and thefile not in ignore_files:
-        foi.append(normpath(join(subdir, thefile)))
-  with Pool() as p:
-    r = p.imap_unordered(parseFile, foi)
-    for chunk in r:
-      for sec, val, fname, path in chunk:
-        if sec not in db:
-          db[sec] = dict()
-        if val not in db[sec]:
-          db[sec][val] = dict()
-        filename = normpath(relpath(abspath(fname), abspath(assets_dir)))
-        if filename not in db[sec][val]:
-          db[sec][val][filename] = list()
-        if path not in db[sec][val][filename]:
-          insort_left(db[sec][val][filename], path)
+  fingerprint = settings_fingerprint([__file__, label_db.__file__])
+  cache = empty_cache(fingerprint)
+  if cache_file is not None:
+    cache = load_cache(cache_file, fingerprint)
+  db = LabelDB()
+  cached = cache["files"]
+  for filename, entry in cached.items():
+    db.add_chunk(entry["chunk"], filename)
+  source = open_source(assets_dir)
+  foi = source.list(tuple(files_of_interest.keys()), ignore_files)
+  foiset = set(foi)
+  for filename in list(cached.keys()):
+    if filename not in foiset:
+      db.forget_chunk(cached.pop(filename)["chunk"], filename)
+  to_parse = list()
+  for filename in foi:
+    if filename in cached:
+      stamp = source.keep_stamp(filename, cached[filename]["stamp"],
+                                check_hashes)
+      if stamp is not None:
+        cached[filename]["stamp"] = stamp
+        continue
+    to_parse.append((filename, check_hashes))
+  print("Files to parse: " + str(len(to_parse)) + " of " + str(len(foi)))
+  with Pool(initializer=init_assets, initargs=(source,)) as p:
+    r = p.imap_unordered(parse_asset, to_parse)
+    for filename, stamp, chunk in r:
+      if filename in cached:
+        db.forget_chunk(cached[filename]["chunk"], filename)
+      db.add_chunk(chunk, filename)
+      if cache_file is not None: # Parsed chunks are kept for the cache only
+        cached[filename] = {"stamp": stamp, "chunk": chunk}
+  if cache_file is not None:
+    save_cache(cache_file, cache)
   return db
 
 def file_by_assets(assets_fname, field, substitutions):
@@ -140,19 +197,43 @@ def file_by_assets(assets_fname, field, substitutions):
   else:
     return normpath(join(texts_prefix, assets_fname)) + ".json"
 
+## Read-only data of the previous database shared with worker processes,
+## see init_worker
+old_substitutions = dict()
+old_translations = dict()
+
+def index_old_translations(texts_dir, index_file = None):
+  ## Returns an index of the previous database:
+  ## { "translation file": { "english text" : (texts, denied alternatives) } }
+  ## Only the first entry with the english text counts
+  ## index_file - a file to keep the index between runs, see TextIndex
+  index = TextIndex(texts_dir, index_file)
+  print("Translation files to index: " + str(index.update()))
+  index.save()
+  return index.by_file()
+
+def init_worker(oldsubs, index):
+  ## Pool initializer, makes the previous database available in worker
+  ## processes, so it is transferred once per worker instead of per label
+  ## oldsubs - the parsed json content of substitutions.json from
+  ##           previous database if it exists
+  ## index - the texts of previous database, see index_old_translations
+  global old_substitutions, old_translations
+  old_substitutions = oldsubs
+  old_translations = index
+
 def process_label(combo):
   ## Creates json file structure for given label then returns
   ## tuple of filename, translation and substitutions
-  ## combo - a tuple of 3 arguments: label, files and oldsubs
+  ## combo - a tuple of 3 arguments: label, files and section
   ##   label - english text from database
   ##   files - filelist were english text used (also from database)
-  ##   oldsubs - the parsed json content of substitutions.json from 
-  ##             previous database if it exists
+  ##   section - the section of database the label belongs to
   ## Returned tuple:
   ##   translation - a part of json file content to write into the database
   ##   filename - a name of file the translation should be added
   ##   substitutions - a part of new formed substitutions file content
-  label, files, oldsubs, section = combo
+  label, files, section = combo
   substitutions = dict()
   obj_file = normpath(getSharedPath(files.keys()))
   translation = dict()
@@ -174,48 +255,55 @@ def process_label(combo):
         if thefile not in substitutions:
           substitutions[thefile] = dict()
         substitutions[thefile][field] = normpath(relpath(filename, prefix))
-      oldfile = normpath(join(prefix, file_by_assets(thefile, field, oldsubs)))
-      if exists(oldfile):
-        olddata = []
-        try:
-          with open_n_decode(oldfile, 'r', 'utf-8') as f:
-            olddata = load(f)
-        except:
-          pass # If can not get old translation for any reason just skip it
-        for oldentry in olddata:
-          if oldentry["Texts"]["Eng"] == label:
-            if "DeniedAlternatives" in oldentry:
-              for a in oldentry["DeniedAlternatives"]:
-                if a not in translation["DeniedAlternatives"]:
-                  insort_left(translation["DeniedAlternatives"], a)
-            translation["Texts"].update(oldentry["Texts"])
-            break
+      oldfile = normpath(join(prefix, file_by_assets(thefile, field,
+                                                    old_substitutions)))
+      if oldfile in old_translations and label in old_translations[oldfile]:
+        oldtexts, olddenied = old_translations[oldfile][label]
+        for a in olddenied:
+          if a not in translation["DeniedAlternatives"]:
+            insort_left(translation["DeniedAlternatives"], a)
+        translation["Texts"].update(oldtexts)
   translation["Files"] = files
   return (filename, translation, substitutions)
 
-def prepare_to_write(database):
-  file_buffer = dict()
-  substitutions = dict()
+def load_old_substitutions():
+  ## All the substitutions are needed, so shards are read at once
   oldsubs = dict()
-  print("Trying to merge with old data...")
   try:
-    with open_n_decode(sub_file, "r", 'utf-8') as f:
-      oldsubs = load(f)
+    oldsubs = load_substitutions(prefix, False)
   except:
+    pass
+  if len(oldsubs) == 0:
     print("No old data found, creating new database.")
-  for section, thedatabase in database.items():
-    with Pool() as p: # Do it parallel
-      result = p.imap_unordered(process_label,
-        [(f, d, oldsubs, section) for f,d in thedatabase.items() ], 40)
-      for fn, js, sb in result: # Merge results
-        for fs, flds in sb.items():
-          if fs not in substitutions:
-            substitutions[fs] = flds
-          else:
-            substitutions[fs].update(flds)
-        if fn not in file_buffer:
-          file_buffer[fn] = list()
-        file_buffer[fn].append(js)
+  return oldsubs
+
+def prepare_to_write(database, index_file = None, store = None):
+  ## store - a TranslationDB to take the previous database from
+  ##   instead of json files
+  file_buffer = dict()
+  substitutions = dict()
+  print("Trying to merge with old data...")
+  if store is not None:
+    oldsubs = store.substitutions()
+    oldindex = store.by_file(prefix)
+  else:
+    oldsubs = load_old_substitutions()
+    oldindex = index_old_translations(join(prefix, texts_prefix), index_file)
+  ## The json structure of label files is only made here, label by label
+  labels = ((val, database.files(label), section)
+            for val, label, section in database.labels())
+  with Pool(initializer=init_worker, initargs=(oldsubs, oldindex)) as p:
+    # Ordered to keep labels of different sections in the same order
+    result = p.imap(process_label, labels, 40)
+    for fn, js, sb in result: # Merge results
+      for fs, flds in sb.items():
+        if fs not in substitutions:
+          substitutions[fs] = flds
+        else:
+          substitutions[fs].update(flds)
+      if fn not in file_buffer:
+        file_buffer[fn] = list()
+      file_buffer[fn].append(js)
   file_buffer[sub_file] = substitutions
   return file_buffer
 
@@ -229,20 +317,59 @@ def catch_danglings(target_path, file_buffer):
   return to_remove
 
 def write_file(filename, content):
-  
+  ## Returns the number of bytes written, 0 if the file was not changed
   filedir = dirname(filename)
   if not filename.endswith("substitutions.json"):
     content = sorted(content, key=lambda x: x["Texts"]["Eng"])
-  if len(filedir) > 0:
-    makedirs(filedir, exist_ok=True)
-  else:
+  if len(filedir) == 0:
     raise Exception("Filename without dir: " + filename)
-  with open_n_decode(filename, "w", 'utf-8') as f:
-    dump(content, f, ensure_ascii=False, indent=2, sort_keys=True)
-  #print("Written " + filename)
+  data = dumps(content, ensure_ascii=False, indent=2,
+               sort_keys=True).encode("utf-8")
+  if write_if_changed(filename, data):
+    return len(data)
+  return 0
+
+def write_batch(batch):
+  ## Writes a batch of files, returns a list of (filename, bytes written,
+  ## error or None), so a failed file does not stop the others
+  result = list()
+  for filename, content in batch:
+    try:
+      result.append((filename, write_file(filename, content), None))
+    except Exception as e:
+      result.append((filename, 0, repr(e)))
+  return result
+
+def batches(items, size):
+  batch = list()
+  for item in items:
+    batch.append(item)
+    if len(batch) == size:
+      yield batch
+      batch = list()
+  if len(batch) > 0:
+    yield batch
 
-def final_write(file_buffer):
-  danglings = catch_danglings(join(prefix, "texts"), file_buffer)
+def write_to_store(file_buffer, store, danglings):
+  ## Replaces the content of TranslationDB with the file buffer
+  ## in one transaction
+  files = dict()
+  for filename, content in file_buffer.items():
+    if filename != sub_file:
+      files[normpath(relpath(filename, prefix))] = sorted(content,
+        key=lambda x: x["Texts"]["Eng"])
+  start = time()
+  store.write_files(files, file_buffer[sub_file], danglings)
+  print("Files written: " + str(len(files)) + " in " +
+        str(round(time() - start, 2)) + " s")
+
+def final_write(file_buffer, store = None):
+  ## store - a TranslationDB to write to instead of json files
+  if store is not None:
+    names = set(normpath(relpath(f, prefix)) for f in file_buffer.keys())
+    danglings = [name for name in store.files() if name not in names]
+  else:
+    danglings = catch_danglings(join(prefix, "texts"), file_buffer)
   print("These files will be deleted:")
   for d in danglings:
     print('  ' + d)
@@ -252,18 +379,83 @@ def final_write(file_buffer):
     print('Cancelled!')
     return
   print('Writing...')
+  if store is not None:
+    write_to_store(file_buffer, store, danglings)
+    return
+  errors = list()
+  for d in danglings:
+    try:
+      remove(d)
+    except OSError as e:
+      errors.append((d, repr(e)))
+  written = [0, 0] # files and bytes
+  def collect(result):
+    for filename, size, error in result.get():
+      if error is not None:
+        errors.append((filename, error))
+      elif size > 0:
+        written[0] += 1
+        written[1] += size
+  start = time()
+  ## Only a few batches are sent to workers at once, so the pickled copies
+  ## of the whole buffer are never kept in memory together
   with Pool() as p:
-    delete_result = p.map_async(remove, danglings)
-    write_result = p.starmap_async(write_file, list(file_buffer.items()))
-    p.close()
-    p.join()
-      
+    pending = deque()
+    maxpending = 2 * cpu_count()
+    texts = ((f, c) for f, c in file_buffer.items() if f != sub_file)
+    for batch in batches(texts, 20):
+      pending.append(p.apply_async(write_batch, (batch,)))
+      while len(pending) >= maxpending or (len(pending) > 0 and
+                                           pending[0].ready()):
+        collect(pending.popleft())
+    while len(pending) > 0:
+      collect(pending.popleft())
+  ## Substitutions may be sharded, they are written in their own layout
+  try:
+    files, size = write_substitutions(prefix, file_buffer[sub_file])
+    written[0] += files
+    written[1] += size
+  except Exception as e:
+    errors.append((sub_file, repr(e)))
+  elapsed = max(time() - start, 0.001)
+  print("Files written: " + str(written[0]) + " of " + str(len(file_buffer)) +
+        ", " + str(written[1]) + " bytes, " +
+        str(round(len(file_buffer) / elapsed)) + " files/s")
+  if len(errors) > 0:
+    for filename, error in errors:
+      print("Failed to write " + filename + ": " + error)
+    raise Exception(str(len(errors)) + " files were not written or deleted")
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Extract labels from unpacked game assets.")
+  parser.add_argument('--assets', default=root_dir, metavar='PATH',
+                      help='unpacked assets directory or packed.pak file')
+  parser.add_argument('--cache', default=cache_file, metavar='FILE',
+                      help='file to keep parsed labels between runs')
+  parser.add_argument('--no-cache', action='store_true',
+                      help='parse all the asset files')
+  parser.add_argument('--index', default=index_file, metavar='FILE',
+                      help='file to keep the index of translations between '
+                           'runs')
+  parser.add_argument('--db', metavar='FILE',
+                      help='SQLite translation database to use instead of '
+                           'json files, see translation_db.py')
+  parser.add_argument('--hash', action='store_true',
+                      help='compare content of files with changed mtime')
+  return parser.parse_args()
+
 # Start here
 if __name__ == "__main__":
-  thedatabase = construct_db(root_dir)
+  arguments = parse_arguments()
+  thecache = None if arguments.no_cache else arguments.cache
+  thedatabase = construct_db(arguments.assets, thecache, arguments.hash)
   #with open("testdb.json", "w") as f:
   #  dump(thedatabase, f, ensure_ascii=False, indent=2, sort_keys=True)
-  file_buffer = prepare_to_write(thedatabase)
+  store = None
+  if arguments.db is not None:
+    store = TranslationDB(arguments.db)
+  file_buffer = prepare_to_write(thedatabase, arguments.index, store)
   #with open("testfb.json", "w") as f:
   #  dump(file_buffer, f, ensure_ascii=False, indent=2, sort_keys=True)
-  final_write(file_buffer)
+  final_write(file_buffer, store)
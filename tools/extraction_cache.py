@@ -0,0 +1,47 @@
+## Persistent cache of labels extracted from game assets.
+## Allows extract_labels to skip parsing of the files which were not changed
+## since the previous run. The cache has a following structure:
+## {"settings": "fingerprint of the settings the cache was made with",
+##  "files": { "file path relative to assets" :
+##    {"stamp": [size, mtime, hash or null],
+##     "chunk": [[section, label, [fields]], ...] } } }
+
+from os import replace
+from hashlib import sha1
+from json import load, dump
+from codecs import open as open_n_decode
+import parser_settings
+import special_cases
+
+
+def settings_fingerprint(extra_files = []):
+  ## Returns a hash of the modules defining which texts are extracted.
+  ## A change in any of them makes the cache obsolete
+  thehash = sha1()
+  for filename in [parser_settings.__file__, special_cases.__file__] + extra_files:
+    with open(filename, "rb") as f:
+      thehash.update(f.read())
+  return thehash.hexdigest()
+
+def empty_cache(fingerprint):
+  return {"settings": fingerprint, "files": dict()}
+
+def load_cache(cache_file, fingerprint):
+  ## Loads the cache from the file given. Returns empty cache if the file
+  ## does not exist, can not be read or was made with other settings
+  try:
+    with open_n_decode(cache_file, "r", "utf-8") as f:
+      cache = load(f)
+  except:
+    return empty_cache(fingerprint)
+  if cache.get("settings") != fingerprint:
+    print("Parser settings were changed, the cache is dropped")
+    return empty_cache(fingerprint)
+  return cache
+
+def save_cache(cache_file, cache):
+  ## Writes to temporary file first to not damage the cache on interruption
+  tmpfile = cache_file + ".tmp"
+  with open_n_decode(tmpfile, "w", "utf-8") as f:
+    dump(cache, f, ensure_ascii=False)
+  replace(tmpfile, cache_file)
@@ -0,0 +1,104 @@
+## Copying of files which skips the ones already up to date.
+## Used to put translations/others into the mod and files from the mod
+## into translations/others. A file is placed by the cheapest way available:
+##   copy-on-write clone (reflink) where the filesystem supports it,
+##   hardlink if asked to (the files are shared then, so editing one
+##     changes another),
+##   plain copy otherwise.
+
+from os import stat, link, remove, replace, makedirs
+from os.path import exists, dirname, samefile
+from shutil import copyfile, copystat
+from utils import content_hash
+try:
+  from fcntl import ioctl
+except ImportError: # Not available on Windows
+  ioctl = None
+
+## The ioctl request cloning a file on Linux (btrfs, xfs and others)
+FICLONE = 0x40049409
+
+
+def reflink(source, dest):
+  ## Makes dest a copy-on-write clone of source. Returns False if
+  ## the filesystem or the platform can not do it
+  if ioctl is None:
+    return False
+  try:
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+      ioctl(dst.fileno(), FICLONE, src.fileno())
+  except OSError:
+    if exists(dest):
+      remove(dest)
+    return False
+  return True
+
+class FileSync():
+  ## Usage:
+  ##   sync = FileSync()
+  ##   for source, dest in files:
+  ##     sync.sync(source, dest)
+  ##   print(sync.report())
+
+  def __init__(self, hardlinks = False):
+    self.hardlinks = hardlinks
+    self.can_reflink = True
+    self.unchanged = 0
+    self.copied = 0
+    self.cloned = 0
+    self.linked = 0
+    self.written = 0
+
+  def is_same(self, source, dest):
+    ## Checks if dest already has the content of source. The copies keep
+    ## mtime of their sources, so the hash is only compared when it differs
+    if not exists(dest):
+      return False
+    if samefile(source, dest):
+      return True
+    sst = stat(source)
+    dst = stat(dest)
+    if sst.st_size != dst.st_size:
+      return False
+    if sst.st_mtime_ns == dst.st_mtime_ns:
+      return True
+    return content_hash(source) == content_hash(dest)
+
+  def place(self, source, dest):
+    ## Puts source to dest through a temporary file, so an interrupted
+    ## copy does not leave a damaged file
+    tmpfile = dest + ".tmp"
+    if exists(tmpfile):
+      remove(tmpfile)
+    if self.hardlinks:
+      try:
+        link(source, tmpfile)
+        replace(tmpfile, dest)
+        self.linked += 1
+        return
+      except OSError:
+        self.hardlinks = False # Other filesystem, do not try again
+    if self.can_reflink and reflink(source, tmpfile):
+      self.cloned += 1
+    else:
+      self.can_reflink = False
+      copyfile(source, tmpfile)
+      self.copied += 1
+      self.written += stat(tmpfile).st_size
+    copystat(source, tmpfile)
+    replace(tmpfile, dest)
+
+  def sync(self, source, dest):
+    ## Makes dest the same as source. Returns False if it already was
+    if self.is_same(source, dest):
+      self.unchanged += 1
+      return False
+    makedirs(dirname(dest), exist_ok = True)
+    self.place(source, dest)
+    return True
+
+  def report(self):
+    return ("Files copied: " + str(self.copied) + ", cloned: " +
+            str(self.cloned) + ", linked: " + str(self.linked) +
+            ", unchanged: " + str(self.unchanged) + ". Bytes written: " +
+            str(self.written))
@@ -1,74 +1,139 @@
 ## Prepares json file. deletes all C-like comments and fixes miltiline stings.
-
-
+from re import compile as regex
 
 
 separator = {"basic": "\n", "string": "\\n", "comment": ""}
+## All the line boundaries the line-by-line file reading splits the text on
+line_ends = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+line_end = regex("\r\n|[" + line_ends + "]")
+runs = {
+  ## Spans of characters which can be copied as is in the given state
+  "basic": regex('[^"/' + line_ends + ']*'),
+  "string": regex('[^"\\\\' + line_ends + ']*'),
+}
 
 
-def parse_line(line, prev_state):
-  result = ""
+def strip_block(text, state):
+  ## Cleans a block of text starting in "state".
+  ## The block should contain complete lines only, except the last
+  ## line of the source which may have no line end.
+  ## Returns cleaned text and the state at the end of the block.
+  result = list()
+  append = result.append
   offset = 0
-  state = prev_state
-  while offset < len(line):
-    c = line[offset]
-    if state != "comment":
-      if state == "basic" and c == '/' and offset + 1 < len(line):
-        if line[offset+1] == "*":
-          state = "comment"
-          offset += 1
-        elif line[offset+1] == "/":
-          break
+  end = len(text)
+  while offset < end:
+    if state == "comment":
+      offset = text.find("*/", offset)
+      if offset == -1:
+        break
+      offset += 2
+      state = "basic"
+      continue
+    stop = runs[state].match(text, offset).end()
+    if stop > offset:
+      append(text[offset:stop])
+      offset = stop
+      if offset == end:
+        break
+    c = text[offset]
+    if c == '"':
+      append(c)
+      state = "string" if state == "basic" else "basic"
+      offset += 1
+    elif c == "/":
+      nextc = text[offset+1:offset+2]
+      if nextc == "*":
+        state = "comment"
+        offset += 2
+      elif nextc == "/":
+        eol = line_end.search(text, offset)
+        if eol is None:
+          break # The last line of source, its separator is added by caller
+        append(separator[state])
+        offset = eol.end()
       else:
-        if state == "string" and c == '\\':
-          result += c
-          result += line[offset+1]
-          offset += 2
-          continue
-        if c not in ['\n','\r']:
-          result += c
-        if c == '"':
-          if state == "string":
-            state = "basic"
-          elif state == "basic":
-            state = "string"
-    else:
-      if c == "*" and offset + 1 < len(line):
-        if line[offset+1] == "/":
-          state = "basic"
-          offset += 1
-    offset += 1
-  return result + separator[state], state
+        if nextc == "":
+          append(c)
+        offset += 1
+    elif c == "\\":
+      nextc = text[offset+1:offset+2]
+      append(text[offset:offset+2])
+      offset += 2
+      if nextc != "" and nextc in line_ends and \
+          not (nextc == "\r" and text[offset:offset+1] == "\n"):
+        append(separator[state]) # The escape has eaten the line end
+    else: # Line end
+      if c == "\r" and text[offset+1:offset+2] == "\n":
+        offset += 2
+      else:
+        if c not in "\r\n":
+          append(c)
+        offset += 1
+      append(separator[state])
+  return "".join(result), state
 
-def prepare(source):
-  result = ""
+def strip_comments(chunks):
+  ## Generator, yields cleaned json text of the source given by chunks.
+  ## chunks - an iterable of strings of any size, like a file object or
+  ##   a list with whole file content in it
   state = "basic"
-  for line in source:
-    newline, state = parse_line(line, state)
-    result += newline
-  return result
+  pending = list()
+  for chunk in chunks:
+    complete = chunk
+    if chunk.endswith("\r"):
+      complete = chunk[:-1] # May be the first half of "\r\n", wait for the rest
+    cut = max(complete.rfind(c) for c in line_ends) + 1
+    if cut <= 0:
+      pending.append(chunk)
+      continue
+    pending.append(chunk[:cut])
+    cleaned, state = strip_block("".join(pending), state)
+    pending = [chunk[cut:]]
+    yield cleaned
+  rest = "".join(pending)
+  if len(rest) > 0:
+    cleaned, state = strip_block(rest, state)
+    if rest[-1] not in line_ends:
+      cleaned += separator[state]
+    yield cleaned
 
+def prepare(source):
+  ## source - a string with whole file content or an iterable of strings
+  if type(source) is str:
+    source = [source]
+  return "".join(strip_comments(source))
 
-def list_field_paths(obj, sep = "/"):
-  result = list()
+
+def subfields(obj):
+  ## Returns an iterator over (field, value) pairs of a dict or a list
   if type(obj) is dict:
-    for field, val in obj.items():
-      if type(val) is dict or type(val) is list:
-        subfields = list_field_paths(val, sep)
-        for subfield in subfields:
-          result.append(field + sep + subfield)
-      else:
-        result.append(field)
+    return iter(obj.items())
   elif type(obj) is list:
-    for i, val in enumerate(obj):
-      field = str(i)
+    return ((str(i), val) for i, val in enumerate(obj))
+  return iter(())
+
+def walk_fields(obj, sep = "/", descend = None):
+  ## Generator, yields (path, value) pairs for every leaf of obj
+  ## in the same order as list_field_paths lists them.
+  ## descend - optional function receiving a path to a dict or a list,
+  ##   if it returns False the whole subtree is skipped
+  stack = [("", subfields(obj))]
+  while len(stack) > 0:
+    prefix, fields = stack[-1]
+    for field, val in fields:
+      path = prefix + field
       if type(val) is dict or type(val) is list:
-        subfields = list_field_paths(val, sep)
-        for subfield in subfields:
-          result.append(field + sep + subfield)
+        if descend is None or descend(path):
+          stack.append((path + sep, subfields(val)))
+          break
       else:
-        result.append(field)
-  return result
+        yield path, val
+    else:
+      stack.pop()
+
+def list_field_paths(obj, sep = "/"):
+  return [path for path, val in walk_fields(obj, sep)]
 
 def field_by_path(obj, path, newval = None, sep = "/"):
   offset = path.find(sep)
@@ -0,0 +1,122 @@
+## Compact in-memory database of labels extracted from game assets.
+## Every file name and field path is kept once in a StringTable, labels
+## refer to them by integer ids kept in arrays. The nested json structure
+## {"section": {"label": {"file": [fields]}}} is only made for a label
+## when it is written, see LabelDB.files.
+
+from array import array
+
+
+class StringTable():
+  ## Keeps every string once and gives it an integer id
+
+  def __init__(self):
+    self.ids = dict()
+    self.strings = list()
+
+  def id(self, string):
+    i = self.ids.get(string)
+    if i is None:
+      i = len(self.strings)
+      self.ids[string] = i
+      self.strings.append(string)
+    return i
+
+  def __getitem__(self, i):
+    return self.strings[i]
+
+class Label():
+  ## The files a label is used in, packed to one array as a sequence of
+  ## [file id, number of fields, field ids...] for every file
+  __slots__ = ["refs"]
+
+  def __init__(self):
+    self.refs = array("i")
+
+  def files(self):
+    ## Yields (file id, field ids) for every file
+    i = 0
+    while i < len(self.refs):
+      count = self.refs[i+1]
+      yield self.refs[i], self.refs[i+2:i+2+count]
+      i += 2 + count
+
+  def remove(self, fileid):
+    ## Removes the file, returns False if the label has no more files
+    refs = array("i")
+    for f, fields in self.files():
+      if f != fileid:
+        refs.extend([f, len(fields)])
+        refs.extend(fields)
+    self.refs = refs
+    return len(refs) > 0
+
+  def add(self, fileid, fields):
+    ## Adds the file with its field ids, the file should not be in the label
+    ## already, see LabelDB.forget_chunk
+    self.refs.extend([fileid, len(fields)])
+    self.refs.extend(fields)
+
+class LabelDB():
+  ## Usage:
+  ##   db = LabelDB()
+  ##   db.add_chunk([[section, label, [fields]], ...], "asset/file")
+  ##   for text, label, section in db.labels():
+  ##     files = db.files(label) # {"asset/file": [fields]}
+
+  def __init__(self):
+    self.filenames = StringTable()
+    self.fields = StringTable()
+    self.sections = {"": dict()} # section: {label text: Label}
+
+  def add_chunk(self, chunk, filename):
+    ## Adds labels of the parsed asset file
+    ## Labels of the file added before should be forgotten first
+    ## chunk - labels of the file grouped by extract_labels.aggregate.
+    ##   Its strings are replaced with the kept ones, so the chunk
+    ##   stored elsewhere does not hold copies of them
+    fileid = self.filenames.id(filename)
+    for entry in chunk:
+      sec, val, paths = entry
+      if sec not in self.sections:
+        self.sections[sec] = dict()
+      labels = self.sections[sec]
+      if val not in labels:
+        labels[val] = Label()
+      ids = [self.fields.id(path) for path in paths]
+      labels[val].add(fileid, ids)
+      entry[2] = [self.fields[i] for i in ids]
+
+  def forget_chunk(self, chunk, filename):
+    ## Removes labels previously added from the asset file
+    fileid = self.filenames.ids.get(filename)
+    if fileid is None:
+      return
+    for sec, val, paths in chunk:
+      labels = self.sections.get(sec)
+      if labels is None or val not in labels:
+        continue
+      if not labels[val].remove(fileid):
+        del labels[val]
+      if len(labels) == 0 and sec != "":
+        del self.sections[sec]
+
+  def labels(self):
+    ## Yields (label text, Label, section) for every label
+    for sec, labels in self.sections.items():
+      for val, label in labels.items():
+        yield val, label, sec
+
+  def files(self, label):
+    ## Returns {"file were label used": [fields were it used in file]}
+    return dict((self.filenames[f], [self.fields[p] for p in fields])
+                for f, fields in label.files())
+
+  def count(self):
+    return sum(len(labels) for labels in self.sections.values())
+
+  def to_json(self):
+    ## Returns the database as nested dicts
+    return dict((sec, dict((val, self.files(label))
+                           for val, label in labels.items()))
+                for sec, labels in self.sections.items())
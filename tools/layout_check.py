@@ -0,0 +1,144 @@
+#!/bin/python
+# A script for checking that translated texts fit the boxes they are shown in
+
+from os import walk
+from os.path import join, normpath
+from re import compile as regex
+from json import load, dumps
+from codecs import open as copen
+from functools import lru_cache
+from multiprocessing import Pool
+from sys import exit
+from special_cases import matches
+import argparse
+
+texts_dir = "./translations/texts"
+report_file = "./layout_report.json"
+
+checker = regex('([^\n\s\t\r]+|\r?[\n\s\t])')
+is_unprintable = regex('\^.+;')
+
+class LayoutProfile():
+  ## A box of width x height characters the texts are shown in.
+  ## A text is checked against the profile if its asset file matches one of
+  ## filePatterns and its json path matches one of pathPatterns
+  ## (any path if pathPatterns is empty)
+
+  def __init__(self, name, width, height, filePatterns, pathPatterns = []):
+    self.name = name
+    self.width = width
+    self.height = height
+    self.fpat = [regex(pat) for pat in filePatterns]
+    self.ppat = [regex(pat) for pat in pathPatterns]
+
+  def match(self, filename, path):
+    return matches(self.fpat, filename) and (len(self.ppat) == 0 or
+                                             matches(self.ppat, path))
+
+layoutProfiles = [
+  LayoutProfile("Страница кодекса", 40, 17, ["^.*\.codex$"],
+                ["^/contentPages/\d+$"]),
+]
+
+
+@lru_cache(maxsize = 16384)
+def tokenize(text):
+  ## Returns the text as a tuple of word lengths, where a new line is 0
+  ## and a space is -1. Color codes and other unprintable words are dropped
+  tokens = list()
+  for word in checker.split(text):
+    wlen = len(word)
+    if wlen == 0 or is_unprintable.match(word):
+      continue
+    if word == '\n':
+      tokens.append(0)
+    elif word == ' ':
+      tokens.append(-1)
+    else:
+      tokens.append(wlen)
+  return tuple(tokens)
+
+@lru_cache(maxsize = 16384)
+def count_lines(text, width):
+  ## Returns the number of lines the text takes in a box of given width
+  lines = 1
+  left = width
+  for token in tokenize(text):
+    if token == 0:
+      lines += 1
+      left = width
+    elif token < 0:
+      left -= 1 # Spaces never wrap
+    else:
+      left -= token
+      if left < 0:
+        left = width - token
+        lines += 1
+  return lines
+
+def label_overflows(label):
+  ## Returns a list of (asset file, json path, profile, lines) for every
+  ## place the translation of label does not fit in
+  result = list()
+  translation = label["Texts"].get("Rus", "")
+  if len(translation) == 0:
+    return result
+  for filename, paths in label["Files"].items():
+    for path in paths:
+      for profile in layoutProfiles:
+        if not profile.match(filename, path):
+          continue
+        lines = count_lines(translation, profile.width)
+        if lines > profile.height:
+          result.append((filename, path, profile, lines))
+  return result
+
+def check_file(filename):
+  ## Returns a list of report entries for the translation file given
+  try:
+    with copen(filename, "r", "utf-8") as f:
+      jsondata = load(f)
+  except:
+    print("Cannot parse file: " + filename)
+    return []
+  result = list()
+  for label in jsondata:
+    for asset, path, profile, lines in label_overflows(label):
+      result.append({"File": filename, "Asset": asset, "Path": path,
+                     "Profile": profile.name, "Lines": lines,
+                     "Height": profile.height,
+                     "Text": label["Texts"]["Rus"]})
+  return result
+
+def check_all(texts_dir):
+  ## Checks all the translation files in parallel
+  ## Returns the report as a list sorted by file and path
+  texts = list()
+  for subdir, dirs, files in walk(texts_dir):
+    for thefile in files:
+      if thefile.endswith(".json"):
+        texts.append(normpath(join(subdir, thefile)))
+  report = list()
+  with Pool() as p:
+    for entries in p.imap_unordered(check_file, texts, 10):
+      report += entries
+  report.sort(key = lambda e: (e["File"], e["Asset"], e["Path"]))
+  return report
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Check that translations fit their boxes.")
+  parser.add_argument('--texts', default=texts_dir, metavar='DIR',
+                      help='directory of translation files')
+  parser.add_argument('--report', default=report_file, metavar='FILE',
+                      help='file to write the texts which do not fit to')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  report = check_all(arguments.texts)
+  with copen(arguments.report, "w", "utf-8") as f:
+    f.write(dumps(report, ensure_ascii = False, indent = 2))
+  print(str(len(report)) + " texts do not fit, written to " + arguments.report)
+  if len(report) > 0:
+    exit(1)
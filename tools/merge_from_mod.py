@@ -1,13 +1,16 @@
 #!/bin/python
 
 import os
-from os.path import dirname, join, exists, relpath, splitext
+from os.path import join, exists, relpath, splitext
 import json
-from json_tools import list_field_paths, field_by_path
-from shutil import copy
+from json_tools import walk_fields
 from utils import get_answer
+from file_sync import FileSync
+from translation_db import TranslationDB
+from substitution_shards import load_substitutions
 from bisect import insort_left
 from codecs import open as copen
+import argparse
 from sys import platform
 if platform == "win32":
   from os.path import normpath as norm
@@ -18,6 +21,7 @@ else:
 
 mod_dir = "./mod"
 root_dir = "./translations"
+conflicts_file = "./conflicts.json"
 
 def parseFile(filename):
   result = []
@@ -29,39 +33,192 @@ def parseFile(filename):
     quit(1)
   return result
 
-def get_data(field, target_file, original_file):
-  ## Returns json structure from "target_file" and
-  ## index of a field in this structure related to "field" in "original_file"
-  ## original_file - a file path in game assets the requested data related to
-  ## field - path to field of interest inside "original_file" json
-  ## target_file - a framework file, containing the requested data
-  data = ""
-  try:
-    with copen(target_file, "r", 'utf-8') as f:
-      data = json.load(f)
-  except:
-    print("Warning: can not load file " + target_file)
-    return None, -1
-  index = -1
-  for i, label in enumerate(data):
-    if original_file in label["Files"] and (field in label["Files"][original_file]):
-      index = i
-      return data, i
+class MergeSession():
+  ## Keeps framework files loaded during the merge, so each of them is
+  ## parsed once and written once at the end by flush
+
+  def __init__(self, policy = "ask"):
+    ## policy - what to do with conflicting translations: "ask" user,
+    ##   use new text ("n"), keep old one ("o") or "defer" the decision
+    ##   by collecting the conflicts to the list
+    self.policy = policy
+    self.conflicts = list()
+    self.deferred = set()
+    self.files = dict() # framework file: its json content or None
+    self.indexes = dict() # framework file: {(original_file, field): index}
+    self.dirty = set()
+
+  def load(self, target_file):
+    data = None
+    try:
+      with copen(target_file, "r", 'utf-8') as f:
+        data = json.load(f)
+    except:
+      print("Warning: can not load file " + target_file)
+    index = dict()
+    for i, label in enumerate(data or []):
+      for original_file, fields in label["Files"].items():
+        for field in fields:
+          if (original_file, field) not in index:
+            index[(original_file, field)] = i
+    self.files[target_file] = data
+    self.indexes[target_file] = index
+
+  def get_data(self, field, target_file, original_file):
+    ## Returns json structure from "target_file" and
+    ## index of a field in this structure related to "field" in "original_file"
+    ## original_file - a file path in game assets the requested data related to
+    ## field - path to field of interest inside "original_file" json
+    ## target_file - a framework file, containing the requested data
+    if target_file not in self.files:
+      self.load(target_file)
+    index = self.indexes[target_file].get((original_file, field), -1)
+    if index == -1:
+      return None, -1
+    return self.files[target_file], index
+
+  def defer(self, target_file, index, conflict):
+    ## Collects the conflict unless the same one for the same label
+    ## was already collected from other field
+    key = (target_file, index, conflict["New"])
+    if key not in self.deferred:
+      self.deferred.add(key)
+      self.conflicts.append(conflict)
+
+  def changed(self, target_file):
+    self.dirty.add(target_file)
+
+  def flush(self):
+    ## Writes all changed files
+    for target_file in sorted(self.dirty):
+      with copen(target_file, "w", 'utf-8') as f:
+        json.dump(self.files[target_file], f, ensure_ascii = False,
+                  indent = 2, sort_keys=True)
+    self.dirty = set()
 
-  return None, -1
+class DatabaseSession(MergeSession):
+  ## Works with the SQLite database instead of json files, see TranslationDB.
+  ## Only the labels the mod touches are loaded, by point queries,
+  ## and flush writes the changed ones in one transaction
 
+  def __init__(self, database, policy = "ask"):
+    MergeSession.__init__(self, policy)
+    self.database = database
+    self.found = dict() # (framework file, original_file, field): label id
+    self.labels = dict() # label id: label
+    self.loaded = dict() # framework file: ids of labels loaded from it
 
+  def get_data(self, field, target_file, original_file):
+    ## Returns a dict of loaded labels and the id of requested label in it
+    key = (normpath(relpath(target_file, root_dir)), original_file, field)
+    if key not in self.found:
+      self.found[key] = self.database.find_field(*key)
+    labelid = self.found[key]
+    if labelid is None:
+      return None, -1
+    if labelid not in self.labels:
+      self.labels[labelid] = self.database.label(labelid)
+      if target_file not in self.loaded:
+        self.loaded[target_file] = set()
+      self.loaded[target_file].add(labelid)
+    return self.labels, labelid
+
+  def flush(self):
+    ## Writes labels of all changed files
+    changed = dict()
+    for target_file in self.dirty:
+      for labelid in self.loaded[target_file]:
+        changed[labelid] = self.labels[labelid]
+    self.database.update_labels(changed)
+    self.dirty = set()
+
+session = MergeSession()
+
+def ask_user(label, target, original, field, newdata):
+  ## Shows the conflict to user and returns the answer
+  ## and manually entered text if any
+  print("Target: " + target)
+  print("Origin: " + original)
+  print("Used in:")
+  i = 0
+  for f, fields in label["Files"].items():
+    if i > 5:
+      print("...and in " + str(len(label["Files"])-i) + " more files")
+      break
+    print("   " + f)
+    for p in fields:
+      print("     at " + p)
+    i += 1
+  print("Denied variants:")
+  for d in label["DeniedAlternatives"]:
+    print('  ' + d)
+  print("Field: " + field)
+  print("English text:")
+  print('  "' + label["Texts"]["Eng"] + '"')
+  print("Old Russian text:")
+  print('  "' + label["Texts"]["Rus"] + '"')
+  print("New Russian text:")
+  print("  \"" + newdata + '"')
+  print("What text should be used?")
+  print(" n - new text")
+  print(" o - old text")
+  print(" e - enter manually")
+  answer = get_answer(["n", "o", "e", "i"])
+  manual = ""
+  if answer == "e":
+    print("Enter new data:")
+    manual = get_answer(3)
+  elif answer == "i":
+    import code
+    code.InteractiveConsole(locals=globals()).interact()
+  return answer, manual
+
+def resolve_conflict(label, newdata, answer, manual = ""):
+  ## Applies the decision to the label with conflicting translations
+  ## answer - "n" to use new text, "o" to keep old text
+  ##   or "e" to use manually entered text
+  ## Returns True if the label was changed
+  changed = False
+  olddata = label["Texts"]["Rus"]
+  denied = label["DeniedAlternatives"]
+  if answer == "n":
+    print("Setting to the new data...")
+    if olddata not in denied:
+      insort_left(denied, olddata)
+    if newdata in denied:
+      denied.remove(newdata)
+    label["Texts"]["Rus"] = newdata
+    changed = True
+  elif answer == "e":
+    label["Texts"]["Rus"] = manual
+    changed = True
+    if newdata not in denied and newdata != manual:
+      insort_left(denied, newdata)
+    if olddata not in denied and olddata != manual:
+      insort_left(denied, olddata)
+    if manual in denied:
+      denied.remove(manual)
+    print("Written: " + manual)
+  elif answer == "o":
+    print("Keeping old data...")
+    if newdata not in denied:
+      insort_left(denied, newdata)
+      changed = True
+    if olddata in denied:
+      denied.remove(olddata)
+      changed = True
+  return changed
 
 def replace(target_file, field, newdata, original):
   ## Tries to merge translation to framework
   ## if translation exists and conflicts with new one
-  ## asks for user to manual merge
+  ## resolves it according to the session policy
   ## target - file in framework related to file should be translated
   ## field - path of field in game assets json file which should be translated
   ## newdata - translated string
   ## original - path to file in game assets should be translated
   target = join(root_dir, target_file)
-  data, index = get_data(field, target, original)
+  data, index = session.get_data(field, target, original)
   if not (type(newdata) is str):
     return
   if data is None:
@@ -82,71 +239,17 @@ def replace(target_file, field, newdata, original):
   elif len(olddata) == 0:
     changed = True
     data[index]["Texts"]["Rus"] = newdata
+  elif session.policy == "defer":
+    session.defer(target, index, {"Target": target_file, "Origin": original,
+      "Field": field, "Eng": data[index]["Texts"]["Eng"], "Old": olddata,
+      "New": newdata, "Resolution": None, "Manual": ""})
+  elif session.policy == "ask":
+    answer, manual = ask_user(data[index], target, original, field, newdata)
+    changed = resolve_conflict(data[index], newdata, answer, manual)
   else:
-    print("Target: " + target)
-    print("Origin: " + original)
-    print("Used in:")
-    i = 0
-    for f, fields in data[index]["Files"].items():
-      if i > 5:
-        print("...and in " + str(len(data[index]["Files"])-i) + " more files")
-        break
-      print("   " + f)
-      for p in fields:
-        print("     at " + p)
-      i += 1
-    print("Denied variants:")
-    for d in data[index]["DeniedAlternatives"]:
-      print('  ' + d)
-    print("Field: " + field)
-    print("English text:")
-    print('  "' + data[index]["Texts"]["Eng"] + '"')
-    print("Old Russian text:")
-    print('  "' + data[index]["Texts"]["Rus"] + '"')
-    print("New Russian text:")
-    print("  \"" + newdata + '"')
-    print("What text should be used?")
-    print(" n - new text")
-    print(" o - old text")
-    print(" e - enter manually")
-    answer = get_answer(["n", "o", "e", "i"])
-    if answer == "n":
-      print("Setting to the new data...")
-      if olddata not in data[index]["DeniedAlternatives"]:
-        insort_left(data[index]["DeniedAlternatives"], olddata)
-      if newdata in data[index]["DeniedAlternatives"]:
-        data[index]["DeniedAlternatives"].remove(newdata)
-      data[index]["Texts"]["Rus"] = newdata
-      changed = True
-    elif answer == "e":
-      print("Enter new data:")
-      answer = get_answer(3)
-      data[index]["Texts"]["Rus"] = answer
-      changed = True
-      if newdata not in data[index]["DeniedAlternatives"] and newdata != answer:
-        insort_left(data[index]["DeniedAlternatives"], newdata)
-        changed = True
-      if olddata not in data[index]["DeniedAlternatives"] and olddata != answer:
-        insort_left(data[index]["DeniedAlternatives"], olddata)
-        changed = True
-      if answer in data[index]["DeniedAlternatives"]:
-        data[index]["DeniedAlternatives"].remove(answer)
-      print("Written: " + answer)
-    elif answer == "i":
-      import code
-      code.InteractiveConsole(locals=globals()).interact()
-    else:
-      print("Keeping old data...")
-      if newdata not in data[index]["DeniedAlternatives"]:
-        insort_left(data[index]["DeniedAlternatives"],newdata)
-        changed = True
-      if olddata in data[index]["DeniedAlternatives"]:
-        data[index]["DeniedAlternatives"].remove(olddata)
-        changed = True
+    changed = resolve_conflict(data[index], newdata, session.policy)
   if changed:
-    pass
-    with copen(target, "w", 'utf-8') as f:
-      json.dump(data, f, ensure_ascii = False, indent = 2, sort_keys=True)
+    session.changed(target)
 
 
 def handleGlitch(field, newdata, original_file, original_files):
@@ -172,9 +275,8 @@ def handleGlitch(field, newdata, original_file, original_files):
   replace(textpath, textfield, text, original_file)
   return True
 
-substitutions = dict()
-with copen(join(root_dir ,"substitutions.json"), "r", 'utf-8') as f:
-  substitutions = json.load(f)
+## Only the shards of substitutions the mod needs are read
+substitutions = load_substitutions(root_dir)
 
 specialHandlers = [
   ## Contains handler-functions for special cases
@@ -210,32 +312,111 @@ def process_replacement(field, newdata, original_file):
 
 
 others_path = normpath(join(root_dir, "others"))
-for subdir, dirs, files in os.walk(mod_dir):
-  for thefile in files:
-    if not thefile.endswith(".patch"):
-      # All non-patch files will be copied to others directory
-      modpath = join(subdir, thefile) # File path in mod dir
-      assetspath = normpath(relpath(modpath, mod_dir)) # File path in packed assets
-      fwpath = normpath(join(others_path,assetspath)) # File path in framework
-      if exists(fwpath):
-        print(fwpath + " already exists! Replacing...")
-      os.makedirs(dirname(fwpath), exist_ok = True)
-      copy(modpath, fwpath)
+
+def merge_mod(mod_dir, sync):
+  ## sync - a FileSync to put non-patch files to others directory with
+  for subdir, dirs, files in os.walk(mod_dir):
+    for thefile in files:
+      if not thefile.endswith(".patch"):
+        # All non-patch files will be copied to others directory
+        modpath = join(subdir, thefile) # File path in mod dir
+        assetspath = normpath(relpath(modpath, mod_dir)) # File path in packed assets
+        fwpath = normpath(join(others_path,assetspath)) # File path in framework
+        existed = exists(fwpath)
+        if sync.sync(modpath, fwpath) and existed:
+          print(fwpath + " already existed! Replaced")
+        continue
+      filename = join(subdir, thefile) # Patch file path
+      # File path in packed assets
+      fname, ext = splitext(filename)
+      assetspath = normpath(relpath(fname, mod_dir))
+      replacements = parseFile(filename)
+      for replacement in replacements:
+        # We expect, that operation is always "replace".
+        # If it isn't... Well, something strange will happen.
+        newdata = replacement["value"] # Imported translated text
+        jsonpath = replacement["path"]
+        if type(newdata) is list: # Very special case if value is list
+          # There we are restoring paths to leafs of structure in newdata
+          for p, val in walk_fields(newdata):
+            process_replacement(join(jsonpath, p), val, assetspath)
+        else: # All as expected, just perform replacement
+          process_replacement(jsonpath, newdata, assetspath)
+
+def apply_resolutions(filename):
+  ## Applies decisions from the conflicts report made by "defer" policy
+  ## The "Resolution" field of conflict should be set to one of
+  ## "n", "o" or "e" (with the text in "Manual" field) answers
+  conflicts = parseFile(filename)
+  unresolved = list()
+  for conflict in conflicts:
+    answer = conflict["Resolution"]
+    if answer not in ["n", "o", "e"] or (answer == "e" and
+                                         len(conflict["Manual"]) == 0):
+      unresolved.append(conflict)
+      continue
+    target = join(root_dir, conflict["Target"])
+    data, index = session.get_data(conflict["Field"], target,
+                                   conflict["Origin"])
+    if data is None:
+      print("Cannot get data for " + conflict["Field"] + " in " + target)
       continue
-    filename = join(subdir, thefile) # Patch file path
-    # File path in packed assets
-    fname, ext = splitext(filename)
-    assetspath = normpath(relpath(fname, mod_dir))
-    replacements = parseFile(filename)
-    for replacement in replacements:
-      # We expect, that operation is always "replace".
-      # If it isn't... Well, something strange will happen.
-      newdata = replacement["value"] # Imported translated text
-      jsonpath = replacement["path"]
-      if type(newdata) is list: # Very special case if value is list
-        paths = list_field_paths(newdata)
-        for p in paths: # There we are restoring paths to leafs of structure in newdata
-          process_replacement(join(jsonpath, p),
-            field_by_path(newdata,p), assetspath)
-      else: # All as expected, just perform replacement
-        process_replacement(jsonpath, newdata, assetspath)
+    label = data[index]
+    if "DeniedAlternatives" not in label:
+      label["DeniedAlternatives"] = list()
+    current = label["Texts"].get("Rus", "")
+    if current == conflict["New"] or (answer == "e" and
+                                     current == conflict["Manual"]):
+      continue # Already applied
+    if current != conflict["Old"]:
+      print("Translation of " + conflict["Field"] + " in " + target +
+            " was changed after the report was made, skipping...")
+      continue
+    if resolve_conflict(label, conflict["New"], answer, conflict["Manual"]):
+      session.changed(target)
+  return unresolved
+
+def write_conflicts(filename, conflicts):
+  with copen(filename, "w", 'utf-8') as f:
+    json.dump(conflicts, f, ensure_ascii = False, indent = 2)
+  print(str(len(conflicts)) + " unresolved conflicts written to " + filename)
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Merge translations from the mod to framework.")
+  parser.add_argument('--conflicts', default="ask",
+                      choices=["ask", "new", "old", "defer"],
+                      help='what to do with conflicting translations')
+  parser.add_argument('--report', default=conflicts_file, metavar='FILE',
+                      help='file to write deferred conflicts to')
+  parser.add_argument('--link', action='store_true',
+                      help='hardlink non-patch files to others directory '
+                           'instead of copying them')
+  parser.add_argument('--db', metavar='FILE',
+                      help='merge to SQLite translation database instead of '
+                           'json files, see translation_db.py')
+  parser.add_argument('--resolutions', metavar='FILE',
+                      help='apply decisions from the conflicts report '
+                           'instead of merging the mod')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  policies = {"ask": "ask", "new": "n", "old": "o", "defer": "defer"}
+  if arguments.db is not None:
+    database = TranslationDB(arguments.db)
+    substitutions = database.substitutions()
+    session = DatabaseSession(database, policies[arguments.conflicts])
+  else:
+    session = MergeSession(policies[arguments.conflicts])
+  try:
+    if arguments.resolutions is not None:
+      session.conflicts = apply_resolutions(arguments.resolutions)
+    else:
+      sync = FileSync(arguments.link)
+      merge_mod(mod_dir, sync)
+      print(sync.report())
+  finally: # Keeps the decisions made before an interruption or an error
+    session.flush()
+  if len(session.conflicts) > 0:
+    write_conflicts(arguments.report, session.conflicts)
@@ -108,3 +108,28 @@ for ext, poi in foi.items():
   for p in poi:
     #print(p)
     files_of_interest[ext].append(regex(p))
+
+
+class PathMatcher():
+  ## Resolves which of the paths of interest are applicable to a file
+  ## and combines them into a single regex, so a path inside json
+  ## can be checked with one match call.
+
+  def __init__(self, patterns):
+    self.patterns = patterns
+    self.combined = dict()
+
+  def for_file(self, filename):
+    ## Returns compiled regex matching paths of interest for given file
+    ## or None if there are no paths of interest in it
+    keys = tuple(k for k in self.patterns.keys()
+                 if k == "*" or filename.endswith(k))
+    if keys not in self.combined:
+      poi = [p for k in keys for p in self.patterns[k]]
+      if len(poi) == 0:
+        self.combined[keys] = None
+      else:
+        self.combined[keys] = regex("|".join(["(?:" + p + ")" for p in poi]))
+    return self.combined[keys]
+
+paths_of_interest = PathMatcher(foi)
@@ -0,0 +1,162 @@
+## Reading and writing of Starbound SBAsset6 (.pak) archives.
+## The archive consists of:
+##   "SBAsset6" magic and big endian uint64 offset of the index
+##   data of the files one after another
+##   the index: "INDEX", metadata map and the list of files
+##     (path, big endian uint64 offset, big endian uint64 size)
+## Numbers of the index are stored as VLQ, metadata values use the
+## binary json format of the game.
+
+from struct import pack, unpack_from
+
+magic = b"SBAsset6"
+index_magic = b"INDEX"
+
+
+def pack_vlq(value):
+  result = bytearray([value & 0x7f])
+  value >>= 7
+  while value > 0:
+    result.append(0x80 | (value & 0x7f))
+    value >>= 7
+  result.reverse()
+  return bytes(result)
+
+def unpack_vlq(data, offset):
+  ## Returns the value and the offset after it
+  value = 0
+  while True:
+    byte = data[offset]
+    offset += 1
+    value = (value << 7) | (byte & 0x7f)
+    if byte & 0x80 == 0:
+      return value, offset
+
+def pack_string(string):
+  data = string.encode("utf-8")
+  return pack_vlq(len(data)) + data
+
+def unpack_string(data, offset):
+  length, offset = unpack_vlq(data, offset)
+  return bytes(data[offset:offset+length]).decode("utf-8"), offset + length
+
+def pack_json(value):
+  if value is None:
+    return b"\x01"
+  elif type(value) is bool:
+    return b"\x03" + (b"\x01" if value else b"\x00")
+  elif type(value) is int:
+    signed = ((-(value + 1)) << 1) | 1 if value < 0 else value << 1
+    return b"\x04" + pack_vlq(signed)
+  elif type(value) is float:
+    return b"\x02" + pack(">d", value)
+  elif type(value) is str:
+    return b"\x05" + pack_string(value)
+  elif type(value) is list:
+    return b"\x06" + pack_vlq(len(value)) + \
+      b"".join(pack_json(v) for v in value)
+  elif type(value) is dict:
+    return b"\x07" + pack_map(value)
+  raise Exception("Can not pack " + str(type(value)) + " to binary json")
+
+def pack_map(obj):
+  return pack_vlq(len(obj)) + \
+    b"".join(pack_string(k) + pack_json(v) for k, v in obj.items())
+
+def unpack_json(data, offset):
+  ## Returns the value and the offset after it
+  kind = data[offset]
+  offset += 1
+  if kind == 1:
+    return None, offset
+  elif kind == 2:
+    return unpack_from(">d", data, offset)[0], offset + 8
+  elif kind == 3:
+    return data[offset] != 0, offset + 1
+  elif kind == 4:
+    signed, offset = unpack_vlq(data, offset)
+    return (-(signed >> 1) - 1 if signed & 1 else signed >> 1), offset
+  elif kind == 5:
+    return unpack_string(data, offset)
+  elif kind == 6:
+    length, offset = unpack_vlq(data, offset)
+    result = list()
+    for i in range(length):
+      value, offset = unpack_json(data, offset)
+      result.append(value)
+    return result, offset
+  elif kind == 7:
+    return unpack_map(data, offset)
+  raise Exception("Unknown binary json type: " + str(kind))
+
+def unpack_map(data, offset):
+  length, offset = unpack_vlq(data, offset)
+  result = dict()
+  for i in range(length):
+    key, offset = unpack_string(data, offset)
+    result[key], offset = unpack_json(data, offset)
+  return result, offset
+
+
+class PakWriter():
+  ## Streams files into a new archive. The index is written on close.
+  ## Usage:
+  ##   with PakWriter("mod.pak") as pak:
+  ##     pak.metadata = {...}
+  ##     pak.add("/path/in/assets", data)
+
+  def __init__(self, filename):
+    self.metadata = dict()
+    self.index = list()
+    self.paths = set()
+    self.written = 0
+    self.f = open(filename, "wb")
+    self.f.write(magic + pack(">Q", 0))
+
+  def add(self, path, data):
+    ## path - absolute path of the file in assets, like "/items/x.patch"
+    ## data - content of the file, str or bytes
+    if type(data) is str:
+      data = data.encode("utf-8")
+    if path in self.paths:
+      raise Exception("Duplicate path in archive: " + path)
+    self.paths.add(path)
+    self.index.append((path, self.f.tell(), len(data)))
+    self.f.write(data)
+    self.written += len(data)
+
+  def close(self):
+    index_offset = self.f.tell()
+    self.f.write(index_magic + pack_map(self.metadata))
+    self.f.write(pack_vlq(len(self.index)))
+    for path, offset, size in self.index:
+      self.f.write(pack_string(path) + pack(">QQ", offset, size))
+    self.f.seek(len(magic))
+    self.f.write(pack(">Q", index_offset))
+    self.f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.close()
+    else:
+      self.f.close()
+
+def read_index(data):
+  ## Reads the archive given as bytes-like object (bytes, mmap)
+  ## Returns metadata and a dict {path: (offset, size)}
+  if bytes(data[:len(magic)]) != magic:
+    raise Exception("Not a SBAsset6 archive")
+  offset = unpack_from(">Q", data, len(magic))[0]
+  if bytes(data[offset:offset+len(index_magic)]) != index_magic:
+    raise Exception("Index of SBAsset6 archive is not found")
+  metadata, offset = unpack_map(data, offset + len(index_magic))
+  count, offset = unpack_vlq(data, offset)
+  index = dict()
+  for i in range(count):
+    path, offset = unpack_string(data, offset)
+    index[path] = unpack_from(">QQ", data, offset)
+    offset += 16
+  return metadata, index
@@ -1,38 +1,114 @@
 
 from os.path import split as splitpath
 from os.path import join
+from functools import lru_cache
 
-def splitfullpath(path):
+@lru_cache(maxsize = 16384)
+def splitCached(path):
   if len(path) == 0:
-    return list()
+    return tuple()
   head, tail = splitpath(path)
-  base = splitfullpath(head)
-  base.append(tail)
-  return base
+  return splitCached(head) + (tail,)
+
+def splitfullpath(path):
+  return list(splitCached(path))
+
+def buildAutomaton(string):
+  ## Builds a suffix automaton of the string. States are numbered, the
+  ## returned lists are indexed by the state number:
+  ##   transitions - dicts {character: next state}
+  ##   links - suffix links
+  ##   lengths - lengths of the longest substrings of states
+  ##   ends - end positions of the first occurrences of substrings of states
+  transitions = [dict()]
+  links = [-1]
+  lengths = [0]
+  ends = [-1]
+  last = 0
+  for i, c in enumerate(string):
+    cur = len(lengths)
+    transitions.append(dict())
+    links.append(0)
+    lengths.append(lengths[last] + 1)
+    ends.append(i)
+    p = last
+    while p != -1 and c not in transitions[p]:
+      transitions[p][c] = cur
+      p = links[p]
+    if p != -1:
+      q = transitions[p][c]
+      if lengths[p] + 1 == lengths[q]:
+        links[cur] = q
+      else:
+        clone = len(lengths)
+        transitions.append(dict(transitions[q]))
+        links.append(links[q])
+        lengths.append(lengths[p] + 1)
+        ends.append(ends[q])
+        while p != -1 and transitions[p].get(c) == q:
+          transitions[p][c] = clone
+          p = links[p]
+        links[q] = clone
+        links[cur] = clone
+    last = cur
+  return transitions, links, lengths, ends
 
 def getSharedPart(strings, minlength = 3):
+  ## Returns the longest substring shared by all the strings prefixed with
+  ## "shared_" or "." if it is shorter than minlength. Of equal length
+  ## substrings the one occurring first in the first string is chosen.
   if len(strings) == 1:
     return strings[0]
   if len(strings) == 0:
     raise Exception("Empty argument passed to getSharedPart")
-  firstlen = len(strings[0])
-  for ethalonlen in range(firstlen, minlength - 1, -1):
-    for offset in range(0, firstlen - ethalonlen + 1):
-      ethalon = strings[0][offset:offset+ethalonlen]
-      #print("Ethalon = " + ethalon)
-      found = True
-      for s in strings:
-        if s.find(ethalon) == -1:
-          found = False
-          break
-      if found:
-        return "shared_" + ethalon
-  return "."
+  if min(len(s) for s in strings) < minlength:
+    return "."
+  transitions, links, lengths, ends = buildAutomaton(strings[0])
+  bylength = sorted(range(len(lengths)), key = lambda v: lengths[v],
+                    reverse = True)
+  common = list(lengths) # Longest shared substring length for each state
+  for s in strings[1:]:
+    matched = [0] * len(lengths)
+    state = 0
+    matchlen = 0
+    for c in s:
+      while state != 0 and c not in transitions[state]:
+        state = links[state]
+        matchlen = lengths[state]
+      if c in transitions[state]:
+        state = transitions[state][c]
+        matchlen += 1
+      if matchlen > matched[state]:
+        matched[state] = matchlen
+    for state in bylength:
+      parent = links[state]
+      if parent > 0 and matched[state] > 0:
+        matched[parent] = lengths[parent]
+      common[state] = min(common[state], matched[state])
+  best = max(common)
+  if best < minlength:
+    return "."
+  offset = 0
+  if best > 0:
+    offset = min(ends[v] - best + 1 for v in range(1, len(lengths))
+                 if common[v] == best and lengths[links[v]] < best)
+  return "shared_" + strings[0][offset:offset+best]
 
 def getSharedPath(files):
+  ## Labels from the same file set share the result, so it is cached.
+  ## The order of files matters for the choice between equal shared parts
+  return sharedPathCached(tuple(files))
+
+def cacheStats():
+  ## Returns hit/miss statistics of the caches in current process
+  return {"getSharedPath": sharedPathCached.cache_info(),
+          "splitfullpath": splitCached.cache_info()}
+
+@lru_cache(maxsize = 4096)
+def sharedPathCached(files):
   splitedfiles = list()
   for f in files:
-    splitedfiles.append(splitfullpath(f))
+    splitedfiles.append(splitCached(f))
   i = 0
   variants = list()
   result = ""
@@ -51,3 +51,69 @@ specialSections = [
   SpecialSection("Префикс главаря банды", ["^.*prefix/.*"], ["^.*quests/bounty/bounty\.config"], True),
   SpecialSection("Окончание главаря банды", ["^.*suffix/.*"], ["^.*quests/bounty/bounty\.config"], True),
 ]
+
+
+class FileSections():
+  ## Special sections applicable to one file. Sections which can not match
+  ## in the file are dropped, path patterns of the rest are combined into
+  ## one regex with a named group per section
+
+  def __init__(self, candidates, default):
+    ## candidates - a list of sections to be checked by path, in order
+    ## default - the name of section for paths matching none of candidates
+    self.default = default
+    self.names = dict()
+    self.combined = None
+    alternatives = list()
+    for i, section in enumerate(candidates):
+      if len(section.ppat) == 0:
+        continue
+      group = "s" + str(i)
+      self.names[group] = section.name
+      alternatives.append("(?P<" + group + ">" +
+        "|".join(["(?:" + p.pattern + ")" for p in section.ppat]) + ")")
+    if len(alternatives) > 0:
+      self.combined = regex("|".join(alternatives))
+
+  def section(self, path):
+    ## Returns the name of section for the path, "" for the common one
+    if self.combined is None:
+      return self.default
+    m = self.combined.match(path)
+    if m is None:
+      return self.default
+    return self.names[m.lastgroup]
+
+class SectionMatcher():
+  ## Resolves special sections for a file once, so for every text of the file
+  ## only one path regex is matched. Keeps the result for the last file,
+  ## as texts come file by file, and the combined regexes for every set of
+  ## candidate sections met
+
+  def __init__(self, sections):
+    self.sections = sections
+    self.combined = dict()
+    self.lastfile = None
+    self.last = None
+
+  def for_file(self, filename):
+    if filename == self.lastfile:
+      return self.last
+    candidates = list()
+    default = ""
+    for i, section in enumerate(self.sections):
+      fmatch = matches(section.fpat, filename)
+      if fmatch and not section.allcond:
+        default = section.name # Matches any path, the later are not needed
+        break
+      if fmatch or not section.allcond:
+        candidates.append(i)
+    key = (tuple(candidates), default)
+    if key not in self.combined:
+      self.combined[key] = FileSections(
+        [self.sections[i] for i in candidates], default)
+    self.lastfile = filename
+    self.last = self.combined[key]
+    return self.last
+
+sectionMatcher = SectionMatcher(specialSections)
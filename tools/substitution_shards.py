@@ -0,0 +1,143 @@
+#!/bin/python3
+# Storage of substitutions: the translation files keeping labels of the
+# fields which are not in the file named after their asset file.
+# The substitutions are kept either in one substitutions.json file or
+# sharded by top-level asset directory, one file per directory:
+#   substitutions/items.json - {"items/...": {"field": "translation file"}}
+#   substitutions/_root.json - the asset files in the root of assets
+# Tools use load_substitutions and write_substitutions, which work with
+# any of the layouts. "substitution_shards.py migrate" converts a single
+# file to shards.
+
+from os import walk, remove
+from os.path import join, exists, isdir
+from json import load, dumps
+from codecs import open as open_n_decode
+from utils import write_if_changed
+import argparse
+
+single_file = "substitutions.json"
+shards_dir = "substitutions"
+root_shard = "_root"
+
+
+def shard_name(asset):
+  ## Returns the name of shard keeping substitutions of the asset file
+  parts = asset.split("/", 1)
+  return parts[0] if len(parts) > 1 else root_shard
+
+def load_json(filename):
+  with open_n_decode(filename, "r", "utf-8") as f:
+    return load(f)
+
+class ShardedSubstitutions():
+  ## Read-only dict-like access to sharded substitutions.
+  ## A shard is read on the first access to an asset file in it
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.shards = dict()
+
+  def shard(self, name):
+    if name not in self.shards:
+      filename = join(self.directory, name + ".json")
+      self.shards[name] = load_json(filename) if exists(filename) else dict()
+    return self.shards[name]
+
+  def __contains__(self, asset):
+    return asset in self.shard(shard_name(asset))
+
+  def __getitem__(self, asset):
+    return self.shard(shard_name(asset))[asset]
+
+  def get(self, asset, default = None):
+    return self.shard(shard_name(asset)).get(asset, default)
+
+  def load_all(self):
+    ## Returns all the substitutions as one dict
+    result = dict()
+    for subdir, dirs, files in walk(self.directory):
+      for thefile in sorted(files):
+        if thefile.endswith(".json"):
+          result.update(self.shard(thefile[:-len(".json")]))
+      break # Shards are not nested
+    return result
+
+def is_sharded(translations_dir):
+  return isdir(join(translations_dir, shards_dir))
+
+def load_substitutions(translations_dir, lazy = True):
+  ## Returns substitutions of the database in translations_dir,
+  ## an empty dict if there are none
+  ## lazy - for sharded layout return ShardedSubstitutions reading only
+  ##   the shards needed instead of the dict with everything
+  if is_sharded(translations_dir):
+    result = ShardedSubstitutions(join(translations_dir, shards_dir))
+    return result if lazy else result.load_all()
+  filename = join(translations_dir, single_file)
+  if exists(filename):
+    return load_json(filename)
+  return dict()
+
+def split_shards(substitutions):
+  ## Returns a dict {shard name: substitutions of its asset files}
+  shards = dict()
+  for asset, fields in substitutions.items():
+    name = shard_name(asset)
+    if name not in shards:
+      shards[name] = dict()
+    shards[name][asset] = fields
+  return shards
+
+def write_substitutions(translations_dir, substitutions, sharded = None):
+  ## Writes substitutions in the layout used by translations_dir, only
+  ## the changed files are written. Shards left without asset files
+  ## are removed.
+  ## sharded - force the layout, True for shards, False for one file
+  ## Returns the number of files and bytes written
+  if sharded is None:
+    sharded = is_sharded(translations_dir)
+  files = dict()
+  if sharded:
+    directory = join(translations_dir, shards_dir)
+    for name, content in split_shards(substitutions).items():
+      files[join(directory, name + ".json")] = content
+    for subdir, dirs, thefiles in walk(directory):
+      for thefile in thefiles:
+        if join(directory, thefile) not in files:
+          remove(join(directory, thefile))
+      break
+  else:
+    files[join(translations_dir, single_file)] = substitutions
+  written = [0, 0]
+  for filename, content in sorted(files.items()):
+    data = dumps(content, ensure_ascii=False, indent=2,
+                 sort_keys=True).encode("utf-8")
+    if write_if_changed(filename, data):
+      written[0] += 1
+      written[1] += len(data)
+  return written
+
+def migrate(translations_dir):
+  ## Splits substitutions.json of translations_dir into shards
+  filename = join(translations_dir, single_file)
+  if not exists(filename):
+    print("Nothing to migrate: " + filename + " does not exist")
+    return
+  substitutions = load_json(filename)
+  written = write_substitutions(translations_dir, substitutions, True)
+  remove(filename)
+  print("Substitutions are split to " + str(written[0]) + " shards")
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Convert substitutions to sharded layout.")
+  parser.add_argument('action', choices=["migrate"],
+                      help='split substitutions.json into shards')
+  parser.add_argument('--translations', default="./translations",
+                      metavar='DIR', help='translations directory')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  migrate(arguments.translations)
@@ -0,0 +1,85 @@
+#!/bin/python3
+# Checks that a packed archive gives the same assets and labels as the
+# directory it was packed from.
+# Run from the tools dir: python3 -m unittest test_asset_sources
+
+import unittest
+from os import walk, makedirs, remove
+from os.path import join, dirname, relpath, exists
+from json import dumps
+from shutil import rmtree
+from tempfile import mkdtemp
+from codecs import open as open_n_decode
+from sbasset import PakWriter
+from asset_sources import DirectorySource, PakSource
+from parser_settings import files_of_interest, ignore_files
+from extract_labels import construct_db
+
+
+assets = {
+  "dialog/converse.config": {
+    "converse": {"default": {"default": ["Hello there!", "Good day."]}},
+    "tout": {"default": {"default": ["Good day."]}}},
+  "dialog/merchant.config": {
+    "converse": {"default": {"default": ["Hello there!"]}}},
+  "items/generic/crafting/rope.item": {
+    "itemName": "rope", "shortdescription": "Rope",
+    "description": "Стальной трос, очень прочный. ^green;Крепкий!^reset;"},
+  "codex/human/diary.codex": {
+    "title": "Diary", "contentPages": ["First page", "Second page"]},
+  "objects/sign.object": {
+    "shortdescription": "Sign", "chatOptions": ["Hi", "Bye"]},
+  # Not interesting: an ignored name and an unknown extension
+  "names/backernamegen.config": {"description": "Ignored by name"},
+  "readme.txt": {"description": "Ignored by extension"},
+}
+
+class AssetSourcesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = mkdtemp()
+    self.assets = join(self.dir, "assets")
+    self.pak = join(self.dir, "packed.pak")
+    for name, content in assets.items():
+      filename = join(self.assets, name)
+      makedirs(dirname(filename), exist_ok = True)
+      with open_n_decode(filename, "w", "utf-8") as f:
+        f.write(dumps(content, ensure_ascii=False, indent=2))
+    with PakWriter(self.pak) as pak:
+      for subdir, dirs, files in walk(self.assets):
+        for thefile in files:
+          filename = join(subdir, thefile)
+          with open(filename, "rb") as f:
+            pak.add("/" + relpath(filename, self.assets).replace("\\", "/"),
+                    f.read())
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def test_sources(self):
+    directory = DirectorySource(self.assets)
+    pak = PakSource(self.pak)
+    endings = tuple(files_of_interest.keys())
+    names = sorted(directory.list(endings, ignore_files))
+    self.assertEqual(sorted(pak.list(endings, ignore_files)), names)
+    self.assertNotIn("names/backernamegen.config", names)
+    self.assertNotIn("readme.txt", names)
+    self.assertIn("dialog/converse.config", names)
+    for name in names:
+      self.assertEqual(pak.read(name), directory.read(name))
+
+  def test_construct_db(self):
+    expected = construct_db(self.assets).to_json()
+    self.assertIn("Стальной трос, очень прочный. ^green;Крепкий!^reset;",
+                  expected[""])
+    self.assertEqual(construct_db(self.pak).to_json(), expected)
+    for source in [self.assets, self.pak]:
+      cache = join(self.dir, "cache.json")
+      for i in range(2): # Fills the cache, then reads from it
+        self.assertEqual(construct_db(source, cache).to_json(), expected)
+        self.assertTrue(exists(cache))
+      self.assertEqual(construct_db(source, cache, True).to_json(), expected)
+      remove(cache)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,72 @@
+#!/bin/python3
+# Round trip tests of SBAsset6 archives and binary json.
+# Run from the tools dir: python3 -m unittest test_sbasset
+
+import unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from sbasset import PakWriter, read_index, pack_json, unpack_json
+
+
+metadata = {
+  "name": "russian",
+  "friendlyName": "Русский перевод",
+  "priority": 9999,
+  "offset": -42,
+  "big": -(1 << 40),
+  "ratio": 0.25,
+  "negative": -1.5,
+  "nothing": None,
+  "yes": True,
+  "no": False,
+  "includes": ["a", 1, [2, None, {"nested": [True, -3]}]],
+  "map": {"inner": {"deep": "значение"}, "empty": {}, "list": []},
+}
+
+class SBAssetTest(unittest.TestCase):
+
+  def setUp(self):
+    self.dir = mkdtemp()
+    self.pak = join(self.dir, "test.pak")
+
+  def tearDown(self):
+    rmtree(self.dir)
+
+  def test_json(self):
+    for value in list(metadata.values()) + [metadata, 0, -0.0, "", 127, 128]:
+      data = pack_json(value)
+      self.assertEqual(unpack_json(data, 0), (value, len(data)))
+
+  def test_round_trip(self):
+    files = {
+      "/dialog/converse.config.patch": "[{\"op\": \"replace\"}]",
+      "/items/текст.patch": "Текст перевода".encode("utf-8"),
+      "/empty.patch": b"",
+      "/_metadata": bytes(range(256)) * 10,
+    }
+    with PakWriter(self.pak) as pak:
+      pak.metadata = metadata
+      for path, data in files.items():
+        pak.add(path, data)
+    with open(self.pak, "rb") as f:
+      data = f.read()
+    readmeta, index = read_index(data)
+    self.assertEqual(readmeta, metadata)
+    self.assertEqual(set(index.keys()), set(files.keys()))
+    for path, content in files.items():
+      if type(content) is str:
+        content = content.encode("utf-8")
+      offset, size = index[path]
+      self.assertEqual(data[offset:offset+size], content)
+
+  def test_duplicate(self):
+    with PakWriter(self.pak) as pak:
+      pak.add("/a.patch", "1")
+      self.assertRaises(Exception, pak.add, "/a.patch", "2")
+
+  def test_not_archive(self):
+    self.assertRaises(Exception, read_index, b"SBAsset5" + bytes(8))
+
+if __name__ == "__main__":
+  unittest.main()
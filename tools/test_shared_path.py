@@ -0,0 +1,74 @@
+#!/bin/python3
+# Checks getSharedPart against the brute-force implementation it replaced.
+# Run from the tools dir: python3 -m unittest test_shared_path
+
+import unittest
+from random import Random
+from shared_path import getSharedPart
+
+
+def referenceSharedPart(strings, minlength = 3):
+  ## The brute-force getSharedPart: tries substrings of the first string
+  ## from the longest to the shortest, from left to right
+  if len(strings) == 1:
+    return strings[0]
+  if len(strings) == 0:
+    raise Exception("Empty argument passed to getSharedPart")
+  firstlen = len(strings[0])
+  for ethalonlen in range(firstlen, minlength - 1, -1):
+    for offset in range(0, firstlen - ethalonlen + 1):
+      ethalon = strings[0][offset:offset+ethalonlen]
+      found = True
+      for s in strings:
+        if s.find(ethalon) == -1:
+          found = False
+          break
+      if found:
+        return "shared_" + ethalon
+  return "."
+
+class SharedPartTest(unittest.TestCase):
+
+  def check(self, strings, minlength = 3):
+    self.assertEqual(getSharedPart(strings, minlength),
+                     referenceSharedPart(strings, minlength),
+                     repr((strings, minlength)))
+
+  def test_random(self):
+    ## Small alphabets make many equal length shared parts
+    rand = Random(0)
+    for i in range(5000):
+      alphabet = "abcd"[:rand.randint(1, 4)]
+      strings = ["".join(rand.choice(alphabet)
+                         for k in range(rand.randint(0, 12)))
+                 for j in range(rand.randint(2, 5))]
+      self.check(strings, rand.randint(0, 4))
+
+  def test_ties(self):
+    ## Of equal length shared parts the first one in the first name wins
+    self.check(["abxcd", "cdyab"])
+    self.check(["cdyab", "abxcd"])
+    self.assertEqual(getSharedPart(["abxcd", "cdyab"], 2), "shared_ab")
+    self.assertEqual(getSharedPart(["cdyab", "abxcd"], 2), "shared_cd")
+
+  def test_minlength(self):
+    for minlength in range(5):
+      self.check(["weapon", "weapons", "heavyweapon"], minlength)
+      self.check(["abc", "xyz"], minlength)
+      self.check(["ab", "ab"], minlength)
+
+  def test_short_names(self):
+    self.check(["ab", "abc"])
+    self.check(["abc", "ab"])
+    self.check(["", "abc"])
+    self.assertEqual(getSharedPart(["ab", "ab"], 3), ".")
+
+  def test_single_name(self):
+    self.assertEqual(getSharedPart(["name"]), "name")
+    self.assertEqual(getSharedPart([""]), "")
+
+  def test_empty(self):
+    self.assertRaises(Exception, getSharedPart, [])
+
+if __name__ == "__main__":
+  unittest.main()
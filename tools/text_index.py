@@ -0,0 +1,158 @@
+## Index of english texts of the translation database.
+## Tells where every english text lives and how it is translated without
+## reading the whole database. The index can be kept in a file between runs,
+## then only the translation files changed since the previous run are read.
+## The file has a following structure:
+## {"root": "absolute path of the texts dir",
+##  "files": { "translation file relative to the texts dir" :
+##    {"stamp": [size, mtime],
+##     "entries": [[texts, denied alternatives], ...] } } }
+## where entries are in the order they are in the translation file.
+
+from os import walk, replace
+from os.path import join, relpath, abspath
+from json import load, dumps
+from codecs import open as open_n_decode
+from multiprocessing import Pool
+from utils import file_stamp
+from sys import platform
+if platform == "win32":
+  from os.path import normpath as normpath_old
+  def normpath(path):
+    return normpath_old(path).replace('\\', '/')
+else:
+  from os.path import normpath
+
+ignored_files = ["substitutions.json", "totallabels.json",
+                 "translatedlabels.json"]
+
+
+def read_entries(filename):
+  ## Returns the entries of translation file for the index
+  ## or None if the file can not be parsed
+  try:
+    with open_n_decode(filename, "r", "utf-8") as f:
+      jsondata = load(f)
+  except:
+    print("Cannot parse file: " + filename)
+    return None
+  return [[entry["Texts"], entry.get("DeniedAlternatives", list())]
+          for entry in jsondata]
+
+class TextIndex():
+  ## Usage:
+  ##   index = TextIndex("./translations/texts", "./text_index.json")
+  ##   index.update()
+  ##   for filename, position, texts, denied in index.lookup("Eng text"):
+  ##     ...
+  ##   index.save()
+
+  def __init__(self, texts_dir, index_file = None):
+    ## index_file - a file to keep the index between runs in
+    self.texts_dir = texts_dir
+    self.index_file = index_file
+    self.root = normpath(abspath(texts_dir))
+    self.files = dict()
+    self.bytext = None
+    if index_file is not None:
+      self.load()
+
+  def load(self):
+    try:
+      with open_n_decode(self.index_file, "r", "utf-8") as f:
+        data = load(f)
+    except:
+      return
+    if data.get("root") == self.root:
+      self.files = data["files"]
+
+  def save(self):
+    if self.index_file is None:
+      return
+    tmpfile = self.index_file + ".tmp"
+    with open_n_decode(tmpfile, "w", "utf-8") as f:
+      f.write(dumps({"root": self.root, "files": self.files},
+                    ensure_ascii=False))
+    replace(tmpfile, self.index_file)
+
+  def path(self, name):
+    ## Returns the path of translation file by its name in the index
+    return normpath(join(self.texts_dir, name))
+
+  def update(self):
+    ## Reads the translation files changed since the index was made
+    ## Returns the number of files read
+    names = list()
+    for subdir, dirs, files in walk(self.texts_dir):
+      for thefile in files:
+        if thefile.endswith(".json") and thefile not in ignored_files:
+          names.append(normpath(relpath(join(subdir, thefile),
+                                        self.texts_dir)))
+    nameset = set(names)
+    for name in list(self.files.keys()):
+      if name not in nameset:
+        del self.files[name]
+    changed = list()
+    for name in names:
+      stamp = file_stamp(self.path(name))[:2]
+      if name not in self.files or self.files[name]["stamp"] != stamp:
+        changed.append((name, stamp))
+    if len(changed) > 0:
+      with Pool() as p:
+        paths = [self.path(name) for name, stamp in changed]
+        for (name, stamp), entries in zip(changed,
+                                          p.imap(read_entries, paths, 20)):
+          if entries is None:
+            self.files.pop(name, None)
+          else:
+            self.files[name] = {"stamp": stamp, "entries": entries}
+    self.bytext = None
+    return len(changed)
+
+  def build(self):
+    self.bytext = dict()
+    for name in sorted(self.files.keys()):
+      for position, (texts, denied) in enumerate(self.files[name]["entries"]):
+        eng = texts["Eng"]
+        if eng not in self.bytext:
+          self.bytext[eng] = list()
+        self.bytext[eng].append((name, position))
+
+  def lookup(self, eng):
+    ## Returns a list of (translation file, position of entry in it,
+    ## texts, denied alternatives) for every entry with the english text
+    if self.bytext is None:
+      self.build()
+    result = list()
+    for name, position in self.bytext.get(eng, []):
+      texts, denied = self.files[name]["entries"][position]
+      result.append((self.path(name), position, texts, denied))
+    return result
+
+  def translations(self):
+    ## Returns a dict { "english text": [(translation file, russian text)] }
+    ## of all translated entries, files go in the sorted order
+    if self.bytext is None:
+      self.build()
+    result = dict()
+    for eng, places in self.bytext.items():
+      for name, position in places:
+        texts = self.files[name]["entries"][position][0]
+        if len(texts.get("Rus", "")) > 0:
+          if eng not in result:
+            result[eng] = list()
+          result[eng].append((self.path(name), texts["Rus"]))
+    return result
+
+  def by_file(self):
+    ## Returns { "translation file": { "english text":
+    ##   (texts, denied alternatives) } }
+    ## Only the first entry with the english text in a file counts
+    result = dict()
+    for name, data in self.files.items():
+      entries = dict()
+      for texts, denied in data["entries"]:
+        if texts["Eng"] not in entries:
+          entries[texts["Eng"]] = (texts, denied)
+      result[self.path(name)] = entries
+    return result
@@ -0,0 +1,279 @@
+## SQLite storage for the translation database.
+## Keeps the same data as translations/texts and substitutions.json, but
+## lets tools find and change single labels without loading whole files.
+## Files are named relative to the translations dir, like
+## "texts/dialog/converse.config.json", the same way substitutions name them.
+## import_texts and export_texts convert from and to the json layout,
+## the conversion is lossless.
+
+import sqlite3
+import argparse
+from os import walk
+from os.path import join, relpath
+from json import load, loads, dumps
+from codecs import open as open_n_decode
+from utils import write_if_changed
+from substitution_shards import load_substitutions, write_substitutions
+from sys import platform
+if platform == "win32":
+  from os.path import normpath as normpath_old
+  def normpath(path):
+    return normpath_old(path).replace('\\', '/')
+else:
+  from os.path import normpath
+
+schema = """
+CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS labels (
+  id INTEGER PRIMARY KEY,
+  file TEXT NOT NULL,
+  position INTEGER NOT NULL,
+  eng TEXT NOT NULL,
+  texts TEXT NOT NULL,
+  has_denied INTEGER NOT NULL,
+  extra TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS labels_file ON labels (file, position);
+CREATE INDEX IF NOT EXISTS labels_eng ON labels (eng);
+CREATE TABLE IF NOT EXISTS refs (
+  label INTEGER NOT NULL,
+  position INTEGER NOT NULL,
+  asset TEXT NOT NULL,
+  field TEXT);
+CREATE INDEX IF NOT EXISTS refs_label ON refs (label, position);
+CREATE INDEX IF NOT EXISTS refs_field ON refs (asset, field);
+CREATE TABLE IF NOT EXISTS denied (
+  label INTEGER NOT NULL,
+  position INTEGER NOT NULL,
+  text TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS denied_label ON denied (label, position);
+CREATE TABLE IF NOT EXISTS substitutions (
+  asset TEXT NOT NULL,
+  field TEXT NOT NULL,
+  target TEXT NOT NULL);
+"""
+
+## Keys of label stored in their own tables, the rest goes to "extra"
+stored_keys = ["Texts", "Files", "DeniedAlternatives"]
+
+
+class TranslationDB():
+  ## Usage:
+  ##   db = TranslationDB("translations.sqlite")
+  ##   db.import_texts("./translations")
+  ##   labels = db.read_file("texts/dialog/converse.config.json")
+  ##   db.export_texts("./translations")
+
+  def __init__(self, filename):
+    self.connection = sqlite3.connect(filename)
+    self.connection.executescript(schema)
+
+  def close(self):
+    self.connection.close()
+
+  def insert_labels(self, name, labels):
+    ## Adds the labels of translation file, must be called in a transaction
+    cursor = self.connection.cursor()
+    cursor.execute("INSERT OR IGNORE INTO files VALUES (?)", (name,))
+    refs = list()
+    denied = list()
+    for position, label in enumerate(labels):
+      extra = dict((k, v) for k, v in label.items() if k not in stored_keys)
+      cursor.execute("INSERT INTO labels (file, position, eng, texts, "
+                     "has_denied, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                     (name, position, label["Texts"]["Eng"],
+                      dumps(label["Texts"], ensure_ascii=False),
+                      int("DeniedAlternatives" in label),
+                      dumps(extra, ensure_ascii=False)))
+      labelid = cursor.lastrowid
+      i = 0
+      for asset, fields in label["Files"].items():
+        if len(fields) == 0: # Keeps the file in the label anyway
+          refs.append((labelid, i, asset, None))
+          i += 1
+        for field in fields:
+          refs.append((labelid, i, asset, field))
+          i += 1
+      for i, alternative in enumerate(label.get("DeniedAlternatives", [])):
+        denied.append((labelid, i, alternative))
+    cursor.executemany("INSERT INTO refs VALUES (?, ?, ?, ?)", refs)
+    cursor.executemany("INSERT INTO denied VALUES (?, ?, ?)", denied)
+
+  def delete_file(self, name):
+    ## Removes the translation file, must be called in a transaction
+    ids = "(SELECT id FROM labels WHERE file = ?)"
+    self.connection.execute("DELETE FROM refs WHERE label IN " + ids, (name,))
+    self.connection.execute("DELETE FROM denied WHERE label IN " + ids,
+                            (name,))
+    self.connection.execute("DELETE FROM labels WHERE file = ?", (name,))
+    self.connection.execute("DELETE FROM files WHERE name = ?", (name,))
+
+  def write_files(self, files, substitutions = None, remove = []):
+    ## Replaces the content of translation files in one transaction
+    ## files - a dict {file name: list of labels}
+    ## substitutions - new content of substitutions if given
+    ## remove - names of files to remove
+    with self.connection:
+      for name in remove:
+        self.delete_file(name)
+      for name, labels in files.items():
+        self.delete_file(name)
+        self.insert_labels(name, labels)
+      if substitutions is not None:
+        self.write_substitutions(substitutions)
+
+  def write_substitutions(self, substitutions):
+    self.connection.execute("DELETE FROM substitutions")
+    self.connection.executemany("INSERT INTO substitutions VALUES (?, ?, ?)",
+      [(asset, field, target) for asset, fields in substitutions.items()
+                              for field, target in fields.items()])
+
+  def files(self):
+    return [row[0] for row in
+            self.connection.execute("SELECT name FROM files ORDER BY name")]
+
+  def make_labels(self, condition, value):
+    ## Makes labels as they are in json from the rows of labels table
+    ## matching the condition, like "labels.file = ?"
+    ## Returns a list of (label id, label)
+    labels = list()
+    byid = dict()
+    for labelid, texts, has_denied, extra in self.connection.execute(
+        "SELECT id, texts, has_denied, extra FROM labels WHERE " + condition +
+        " ORDER BY position", (value,)):
+      label = loads(extra)
+      label["Texts"] = loads(texts)
+      label["Files"] = dict()
+      if has_denied:
+        label["DeniedAlternatives"] = list()
+      labels.append((labelid, label))
+      byid[labelid] = label
+    for labelid, asset, field in self.connection.execute(
+        "SELECT refs.label, refs.asset, refs.field FROM refs JOIN labels "
+        "ON refs.label = labels.id WHERE " + condition +
+        " ORDER BY refs.label, refs.position", (value,)):
+      files = byid[labelid]["Files"]
+      if asset not in files:
+        files[asset] = list()
+      if field is not None:
+        files[asset].append(field)
+    for labelid, text in self.connection.execute(
+        "SELECT denied.label, denied.text FROM denied JOIN labels "
+        "ON denied.label = labels.id WHERE " + condition +
+        " ORDER BY denied.label, denied.position", (value,)):
+      byid[labelid]["DeniedAlternatives"].append(text)
+    return labels
+
+  def read_file(self, name):
+    ## Returns the labels of translation file as they are in json
+    return [label for labelid, label
+            in self.make_labels("labels.file = ?", name)]
+
+  def label(self, labelid):
+    labels = self.make_labels("labels.id = ?", labelid)
+    return labels[0][1] if len(labels) > 0 else None
+
+  def find_field(self, name, asset, field):
+    ## Returns id of the first label of the file used at the field of asset
+    ## or None if there is no such a label
+    row = self.connection.execute(
+      "SELECT labels.id FROM refs JOIN labels ON refs.label = labels.id "
+      "WHERE refs.asset = ? AND refs.field = ? AND labels.file = ? "
+      "ORDER BY labels.position LIMIT 1", (asset, field, name)).fetchone()
+    return None if row is None else row[0]
+
+  def find_text(self, eng):
+    ## Returns a list of (file, position, label id) for the english text
+    return self.connection.execute(
+      "SELECT file, position, id FROM labels WHERE eng = ? "
+      "ORDER BY file, position", (eng,)).fetchall()
+
+  def update_labels(self, labels):
+    ## Writes changed texts and denied alternatives of labels
+    ## in one transaction. labels - a dict {label id: label}
+    with self.connection:
+      for labelid, label in labels.items():
+        self.connection.execute(
+          "UPDATE labels SET texts = ?, has_denied = ? WHERE id = ?",
+          (dumps(label["Texts"], ensure_ascii=False),
+           int("DeniedAlternatives" in label), labelid))
+        self.connection.execute("DELETE FROM denied WHERE label = ?",
+                                (labelid,))
+        self.connection.executemany("INSERT INTO denied VALUES (?, ?, ?)",
+          [(labelid, i, a) for i, a
+           in enumerate(label.get("DeniedAlternatives", []))])
+
+  def substitutions(self):
+    result = dict()
+    for asset, field, target in self.connection.execute(
+        "SELECT asset, field, target FROM substitutions ORDER BY rowid"):
+      if asset not in result:
+        result[asset] = dict()
+      result[asset][field] = target
+    return result
+
+  def by_file(self, prefix):
+    ## Returns { "translation file": { "english text":
+    ##   (texts, denied alternatives) } } like TextIndex.by_file
+    ## prefix - the translations dir the file names are joined to
+    result = dict((normpath(join(prefix, name)), dict())
+                  for name in self.files())
+    denied = dict()
+    for labelid, text in self.connection.execute(
+        "SELECT label, text FROM denied ORDER BY label, position"):
+      if labelid not in denied:
+        denied[labelid] = list()
+      denied[labelid].append(text)
+    for labelid, name, eng, texts in self.connection.execute(
+        "SELECT id, file, eng, texts FROM labels ORDER BY file, position"):
+      entries = result[normpath(join(prefix, name))]
+      if eng not in entries:
+        entries[eng] = (loads(texts), denied.get(labelid, list()))
+    return result
+
+  def import_texts(self, translations_dir):
+    ## Replaces the content of database with translations/texts and
+    ## substitutions.json from translations_dir
+    files = dict()
+    for subdir, dirs, thefiles in walk(join(translations_dir, "texts")):
+      for thefile in thefiles:
+        filename = join(subdir, thefile)
+        try:
+          with open_n_decode(filename, "r", "utf-8") as f:
+            files[normpath(relpath(filename, translations_dir))] = load(f)
+        except:
+          print("Cannot parse file: " + filename)
+    substitutions = load_substitutions(translations_dir, False)
+    self.write_files(files, substitutions, self.files())
+    return len(files)
+
+  def export_texts(self, translations_dir):
+    ## Writes the database to json files in translations_dir
+    ## Returns the number of files changed
+    written = 0
+    for name in self.files():
+      if write_if_changed(join(translations_dir, name),
+                          dumps(self.read_file(name), ensure_ascii=False,
+                                indent=2, sort_keys=True)):
+        written += 1
+    return written + write_substitutions(translations_dir,
+                                         self.substitutions())[0]
+
+def parse_arguments():
+  parser = argparse.ArgumentParser(
+                   description="Convert translation database between "
+                               "json files and SQLite.")
+  parser.add_argument('action', choices=["import", "export"],
+                      help='import json files to SQLite or export them back')
+  parser.add_argument('database', help='SQLite database file')
+  parser.add_argument('--translations', default="./translations",
+                      metavar='DIR', help='translations directory')
+  return parser.parse_args()
+
+if __name__ == "__main__":
+  arguments = parse_arguments()
+  database = TranslationDB(arguments.database)
+  if arguments.action == "import":
+    print("Files imported: " + str(database.import_texts(arguments.translations)))
+  else:
+    print("Files written: " + str(database.export_texts(arguments.translations)))
+  database.close()
@@ -1,4 +1,7 @@
 from sys import stdin
+from os import stat, makedirs, replace
+from os.path import exists, dirname
+from hashlib import sha1
 
 
 def get_answer(criteria):
@@ -12,3 +15,32 @@ def get_answer(criteria):
     while answer not in criteria:
       answer = stdin.readline().strip()
   return answer
+
+def content_hash(filename):
+  with open(filename, "rb") as f:
+    return sha1(f.read()).hexdigest()
+
+def file_stamp(filename, with_hash = False):
+  ## Returns a list of file size, modification time and optionally
+  ## the hash of the file content
+  st = stat(filename)
+  thehash = None
+  if with_hash:
+    thehash = content_hash(filename)
+  return [st.st_size, st.st_mtime_ns, thehash]
+
+def write_if_changed(filename, content):
+  ## Writes the content (str or bytes) to the file unless the file already
+  ## has the same content. Returns True if the file was written.
+  ## The content goes to a temporary file first, so an interrupted write
+  ## never leaves the file damaged
+  if type(content) is str:
+    content = content.encode("utf-8")
+  if exists(filename) and content_hash(filename) == sha1(content).hexdigest():
+    return False
+  makedirs(dirname(filename), exist_ok = True)
+  tmpfile = filename + ".tmp"
+  with open(tmpfile, "wb") as f:
+    f.write(content)
+  replace(tmpfile, filename)
+  return True